@@ -0,0 +1,489 @@
+"""
+Local stand-ins for the services Invite Tool talks to, for benchmarks and offline
+runs: a fake Authentik v3 API, a fake Twingate GraphQL API, and an SMTP sink. All
+run on background threads and listen on 127.0.0.1.
+"""
+
+import datetime
+import gzip
+import json
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_EPOCH = "2024-01-01T00:00:00Z"
+
+
+def _user(pk: int, username: str) -> dict:
+    return {
+        "pk": pk,
+        "username": username,
+        "name": username.title(),
+        "is_active": True,
+        "last_login": None,
+        "is_superuser": False,
+        "groups": [],
+        "groups_obj": [],
+        "email": f"{username}@example.com",
+        "avatar": "",
+        "attributes": {},
+        "uid": uuid.uuid5(uuid.NAMESPACE_OID, username).hex,
+        "path": "users",
+        "type": "internal",
+        "uuid": str(uuid.uuid5(uuid.NAMESPACE_OID, username)),
+        "password_change_date": _EPOCH,
+        "date_joined": _EPOCH,
+        "last_updated": _EPOCH,
+        "roles": [],
+        "roles_obj": [],
+    }
+
+
+def _group(pk: int, name: str) -> dict:
+    return {
+        "pk": str(uuid.uuid5(uuid.NAMESPACE_OID, f"group-{name}")),
+        "num_pk": pk,
+        "name": name,
+        "is_superuser": name == "admin",
+        "parent": None,
+        "parent_name": None,
+        "users": [],
+        "users_obj": [],
+        "attributes": {},
+        "roles": [],
+        "roles_obj": [],
+        "children": [],
+        "children_obj": [],
+    }
+
+
+def _flow(slug: str, designation: str) -> dict:
+    pk = str(uuid.uuid5(uuid.NAMESPACE_OID, f"flow-{slug}"))
+    return {
+        "pk": pk,
+        "policybindingmodel_ptr_id": pk,
+        "name": slug.replace("-", " ").title(),
+        "slug": slug,
+        "title": slug.replace("-", " ").title(),
+        "designation": designation,
+        "background": "",
+        "stages": [],
+        "policies": [],
+        "cache_count": 0,
+        "export_url": f"/api/v3/flows/instances/{slug}/export/",
+        "layout": "stacked",
+        "denied_action": "message_continue",
+        "authentication": "none",
+        "compatibility_mode": False,
+    }
+
+
+class AuthentikState:
+    """
+    In-memory users, groups, flows, and invitations served by FakeAuthentik.
+    """
+
+    def __init__(
+        self,
+        users: int = 1000,
+        groups: tuple[str, ...] = ("plexuser", "admin", "family"),
+    ):
+        self.lock = threading.Lock()
+        self.users = [_user(i + 1, f"user{i}") for i in range(users)]
+        self.groups = [_group(i + 1, g) for i, g in enumerate(groups)]
+        self.flows = [
+            _flow("enrollment-invitation", "enrollment"),
+            _flow("default-authentication-flow", "authentication"),
+        ]
+        self.invites: list[dict] = []
+        self.requests = 0
+
+    def addInvite(self, body: dict) -> dict:
+        flow = next(
+            (f for f in self.flows if f["pk"] == body.get("flow")), self.flows[0]
+        )
+        invite = {
+            "pk": str(uuid.uuid4()),
+            "name": body["name"],
+            "expires": body.get("expires"),
+            "fixed_data": body.get("fixed_data") or {},
+            "created_by": {
+                "pk": 1,
+                "username": "akadmin",
+                "name": "authentik Default Admin",
+                "is_active": True,
+                "last_login": None,
+                "email": "",
+                "attributes": {},
+                "uid": "akadmin",
+            },
+            "single_use": body.get("single_use", True),
+            "flow": flow["pk"],
+            "flow_obj": flow,
+        }
+        with self.lock:
+            self.invites.append(invite)
+        return invite
+
+
+def _filter(
+    items: list[dict], query: dict[str, str], fields: tuple[str, ...]
+) -> list[dict]:
+    for field in fields:
+        if field in query:
+            items = [i for i in items if str(i.get(field)) == query[field]]
+    if "search" in query:
+        needle = query["search"].lower()
+        items = [i for i in items if needle in json.dumps(i).lower()]
+    if "ordering" in query:
+        key = query["ordering"]
+        reverse = key.startswith("-")
+        key = key.lstrip("-")
+        items = sorted(items, key=lambda i: str(i.get(key, "")), reverse=reverse)
+    return items
+
+
+def _page(items: list[dict], query: dict[str, str], maxPageSize: int) -> dict:
+    page = max(1, int(query.get("page", 1)))
+    size = min(maxPageSize, max(1, int(query.get("page_size", 20))))
+    total = len(items)
+    pages = max(1, -(-total // size))
+    start = (page - 1) * size
+    chunk = items[start : start + size]
+    return {
+        "pagination": {
+            "next": page + 1 if page < pages else 0,
+            "previous": page - 1 if page > 1 else 0,
+            "count": total,
+            "current": page,
+            "total_pages": pages,
+            "start_index": start + 1 if chunk else 0,
+            "end_index": start + len(chunk),
+        },
+        "results": chunk,
+        "autocomplete": {},
+    }
+
+
+class _AuthentikHandler(BaseHTTPRequestHandler):
+    server: "FakeAuthentik"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict | None = None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        # like the real server behind a proxy, compress list pages when asked
+        if len(data) > 1024 and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            data = gzip.compress(data, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, method: str):
+        fake = self.server
+        state = fake.state
+        with state.lock:
+            state.requests += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+        prefix = "/api/v3"
+        if not path.startswith(prefix):
+            return self._reply(404, {"detail": "Not found."})
+        path = path[len(prefix) :]
+
+        body = {}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = json.loads(self.rfile.read(length))
+
+        listings = {
+            "/core/users": (state.users, ("username", "email", "is_active")),
+            "/core/groups": (state.groups, ("name",)),
+            "/flows/instances": (state.flows, ("designation", "slug")),
+            "/stages/invitation/invitations": (state.invites, ("name", "flow")),
+        }
+
+        if method == "GET" and path in listings:
+            items, fields = listings[path]
+            with state.lock:
+                items = list(items)
+            return self._reply(
+                200, _page(_filter(items, query, fields), query, fake.maxPageSize)
+            )
+
+        if method == "POST" and path == "/stages/invitation/invitations":
+            return self._reply(201, state.addInvite(body))
+
+        invitePrefix = "/stages/invitation/invitations/"
+        if method == "DELETE" and path.startswith(invitePrefix):
+            pk = path[len(invitePrefix) :]
+            with state.lock:
+                before = len(state.invites)
+                state.invites = [i for i in state.invites if i["pk"] != pk]
+                found = len(state.invites) != before
+            return (
+                self._reply(204)
+                if found
+                else self._reply(404, {"detail": "Not found."})
+            )
+
+        return self._reply(404, {"detail": "Not found."})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class FakeAuthentik(ThreadingHTTPServer):
+    """
+    Serves the parts of the Authentik v3 API Invite Tool uses: users, groups, flows,
+    and invitations, paginated like the real thing and filterable by the same
+    query parameters. `latency` (seconds) is added to every request, and
+    `maxPageSize` caps page_size the way the server does.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        state: AuthentikState | None = None,
+        latency: float = 0,
+        maxPageSize: int = 100,
+    ):
+        super().__init__(("127.0.0.1", 0), _AuthentikHandler)
+        self.state = state or AuthentikState()
+        self.latency = latency
+        self.maxPageSize = maxPageSize
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeAuthentik":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# one aliased mutation field, e.g. u0: userCreate(email: $email0, role: MEMBER)
+_FIELD = re.compile(r"(\w+)\s*:\s*(\w+)\s*\(([^)]*)\)")
+_ARG = re.compile(r"(\w+)\s*:\s*(\$?\w+)")
+
+
+class TwingateState:
+    """
+    Users in the fake Twingate network. Addresses in `failEmails` are refused, to
+    exercise partial failures.
+    """
+
+    def __init__(self, failEmails: set[str] | None = None):
+        self.lock = threading.Lock()
+        self.users: dict[str, dict] = {}
+        self.failEmails = set(failEmails or ())
+        self.requests = 0
+        self.mutations = 0
+
+    def createUser(self, args: dict) -> dict:
+        email = str(args.get("email") or "")
+        with self.lock:
+            self.mutations += 1
+            if not email or email in self.failEmails:
+                return {
+                    "ok": False,
+                    "error": f"Could not create user {email}.",
+                    "entity": None,
+                }
+            if email in self.users:
+                return {
+                    "ok": False,
+                    "error": "A user with this email already exists.",
+                    "entity": None,
+                }
+            user = {"id": f"VXNlcjo{len(self.users) + 1}", "email": email, **args}
+            self.users[email] = user
+        return {"ok": True, "error": None, "entity": {"id": user["id"]}}
+
+
+class _TwingateHandler(BaseHTTPRequestHandler):
+    server: "FakeTwingate"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        fake = self.server
+        state = fake.state
+        with state.lock:
+            state.requests += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if urlparse(self.path).path.rstrip("/") != "/api/graphql":
+            return self._reply(404, {"errors": [{"message": "Not found."}]})
+        if self.headers.get("X-API-KEY") != fake.key:
+            return self._reply(401, {"errors": [{"message": "Invalid API key."}]})
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        query = str(body.get("query") or "")
+        variables = body.get("variables") or {}
+
+        # only the top-level selection matters: skip past the operation's own
+        # variable list to the first brace
+        selection = query[query.index("{") + 1 :] if "{" in query else ""
+        data = {}
+        for alias, field, rawArgs in _FIELD.findall(selection):
+            if field != "userCreate":
+                return self._reply(
+                    200, {"errors": [{"message": f"Unsupported field {field}."}]}
+                )
+            args = {}
+            for name, value in _ARG.findall(rawArgs):
+                args[name] = (
+                    variables.get(value[1:]) if value.startswith("$") else value
+                )
+            data[alias] = state.createUser(args)
+        self._reply(200, {"data": data})
+
+
+class FakeTwingate(ThreadingHTTPServer):
+    """
+    Serves the userCreate mutation of the Twingate Admin API at /api/graphql/,
+    aliased as many times per request as the client likes. `latency` (seconds)
+    is added to every request.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, state: TwingateState | None = None, latency: float = 0, key: str = "bench"
+    ):
+        super().__init__(("127.0.0.1", 0), _TwingateHandler)
+        self.state = state or TwingateState()
+        self.latency = latency
+        self.key = key
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/graphql/"
+
+    def start(self) -> "FakeTwingate":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: "SMTPSink"
+
+    def _send(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        sink = self.server
+        self._send("220 sink ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().upper()
+            if sink.latency:
+                time.sleep(sink.latency)
+
+            if command.startswith((b"EHLO", b"HELO")):
+                self._send("250-sink")
+                self._send("250-AUTH PLAIN LOGIN")
+                self._send("250 8BITMIME")
+            elif command.startswith(b"AUTH"):
+                self._send("235 2.7.0 Authentication successful")
+            elif command == b"DATA":
+                self._send("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data.rstrip(b"\r\n") == b".":
+                        break
+                    size += len(data)
+                with sink.lock:
+                    sink.messages += 1
+                    sink.bytes += size
+                self._send("250 2.0.0 Ok: queued")
+            elif command == b"QUIT":
+                self._send("221 2.0.0 Bye")
+                return
+            else:
+                self._send("250 2.0.0 Ok")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Accepts and counts mail without delivering it. No STARTTLS, so point an
+    SMTPPool at it with starttls=False.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "SMTPSink":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def isoIn(days: float) -> str:
+    """
+    An ISO timestamp `days` from now, for seeding invites with expiry dates.
+    """
+
+    when = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=days)
+    return when.isoformat()
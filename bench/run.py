@@ -0,0 +1,398 @@
+"""
+Benchmarks for Invite Tool.
+
+Runs microbenchmarks of the pure code paths and an end-to-end batch invite run
+against the local stand-ins in bench/fakes.py, then appends one JSON line of
+results to bench/results.jsonl (or --out) so runs can be compared over time.
+
+    python bench/run.py
+    python bench/run.py --only micro
+    python bench/run.py --roster 500 --users 20000 --latency 20
+    python bench/run.py --only tape
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Callable
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, REPO_DIR)
+
+from bench.fakes import (  # noqa: E402
+    AuthentikState,
+    FakeAuthentik,
+    FakeTwingate,
+    SMTPSink,
+)
+
+CONF_TEMPLATE = """\
+fromAddr: invites@example.com
+authentik:
+  url: {url}
+  key: bench
+twingate:
+  use: false
+mailtrap:
+  key: bench
+  host: 127.0.0.1
+  port: {smtpPort}
+  starttls: false
+  rateLimit: 100000
+  burst: 1000
+formats:
+  username:
+    separator: ''
+    first: initial
+    middle: ''
+    last: full
+"""
+
+
+def measure(func: Callable[[int], Any], n: int) -> dict:
+    """
+    Calls func(i) for i in range(n) and reports throughput and mean latency.
+    """
+
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    elapsed = time.perf_counter() - start
+    return {
+        "n": n,
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(n / elapsed, 1) if elapsed else None,
+        "mean_us": round(elapsed / n * 1e6, 3),
+    }
+
+
+def _offlineUser(i: int):
+    from invite_tool.user import HomelabUser
+
+    return HomelabUser(
+        f"first{i}",
+        f"last{i}",
+        f"person{i}@example.com",
+        ["plexuser"],
+        phone="+1 555 010 %04d" % (i % 10000),
+    )
+
+
+def microbenchmarks(n: int) -> dict[str, dict]:
+    from invite_tool.directory import DirectoryIndex
+    from invite_tool.invite import InviteEmail
+    from invite_tool.mail import Email, normalizeMany
+    from invite_tool.phone import FormatRegistry, Phone, formatRegistry
+    from invite_tool.user import validateUser
+
+    results = {}
+
+    numbers = ["+1 555 010 %04d" % (i % 1000) for i in range(n)]
+    results["phone.Phone"] = measure(lambda i: Phone(numbers[i]), n)
+    uncached = FormatRegistry.fromFile()
+    uncached.format = uncached._format  # type: ignore[method-assign]
+    results["phone.Phone_uncached"] = measure(lambda i: Phone(numbers[i], uncached), n)
+    results["phone.format_many"] = measure(
+        lambda i: formatRegistry().formatMany(numbers[:100]), max(1, n // 100)
+    )
+
+    addrs = [f"Person.{i}@Mail.Example.co.uk" for i in range(n)]
+    results["mail.Email"] = measure(lambda i: Email(addrs[i]), n)
+    results["mail.normalizeMany"] = measure(
+        lambda i: normalizeMany(addrs[:100]), max(1, n // 100)
+    )
+
+    users = [_offlineUser(i) for i in range(min(n, 1000))]
+    results["user.HomelabUser"] = measure(lambda i: _offlineUser(i), min(n, 1000))
+    index = DirectoryIndex(groups=[SimpleNamespace(name="plexuser")])
+    results["user.validateUser"] = measure(
+        lambda i: validateUser(users[i % len(users)], index), n
+    )
+    results["user._makeUsername"] = measure(
+        lambda i: users[i % len(users)]._makeUsername(), n
+    )
+
+    flow = SimpleNamespace(slug="enrollment-invitation")
+    invite = SimpleNamespace(
+        pk="00000000-0000-0000-0000-000000000000", expires="2030-01-01 00:00:00"
+    )
+    results["invite.InviteEmail.message"] = measure(
+        lambda i: InviteEmail(
+            users[i % len(users)],
+            "invites@example.com",
+            invite,
+            flow,
+            "auth.example.com",
+        ).message,  # type: ignore[arg-type]
+        n,
+    )
+    return results
+
+
+def importTime() -> dict:
+    """
+    Wall time of a fresh interpreter importing invite_tool.main, the startup cost
+    of every CLI invocation.
+    """
+
+    env = dict(os.environ, PYTHONPATH=os.path.join(REPO_DIR, "src"))
+    code = (
+        "import time; t = time.perf_counter(); import invite_tool.main; "
+        "print(time.perf_counter() - t)"
+    )
+    samples = []
+    for _ in range(5):
+        out = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            return {
+                "skipped": out.stderr.strip().splitlines()[-1]
+                if out.stderr
+                else "import failed"
+            }
+        samples.append(float(out.stdout.strip()))
+    return {
+        "n": len(samples),
+        "best_ms": round(min(samples) * 1000, 2),
+        "median_ms": round(sorted(samples)[2] * 1000, 2),
+    }
+
+
+def endToEnd(roster: int, users: int, latency: float, pageSize: int) -> dict:
+    try:
+        import authentik_client  # noqa: F401
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    from invite_tool import batch
+    from invite_tool.authentik import Authentik
+    from invite_tool.roster import RosterEntry
+
+    api = FakeAuthentik(
+        AuthentikState(users=users), latency=latency, maxPageSize=pageSize
+    ).start()
+    twingate = FakeTwingate(latency=latency).start()
+    sink = SMTPSink().start()
+    try:
+        conf = {
+            "fromAddr": "invites@example.com",
+            "authentik": {"url": api.url, "key": "bench", "pageSize": pageSize},
+            "twingate": {"use": True, "key": "bench", "url": twingate.url},
+            "mailtrap": {
+                "key": "bench",
+                "host": "127.0.0.1",
+                "port": sink.port,
+                "starttls": False,
+                "rateLimit": 100000,
+                "burst": 1000,
+            },
+        }
+        entries = [
+            RosterEntry(
+                row=i + 1,
+                first=f"bench{i}",
+                last=f"person{i}",
+                email=f"bench{i}@example.com",
+                # every tenth person is an admin, who also needs Twingate
+                groups=["plexuser", "admin"] if i % 10 == 0 else ["plexuser"],
+            )
+            for i in range(roster)
+        ]
+
+        authObj = Authentik(conf["authentik"])
+        start = time.perf_counter()
+        results = batch.runBatch(authObj, conf, entries)
+        elapsed = time.perf_counter() - start
+    finally:
+        api.stop()
+        twingate.stop()
+        sink.stop()
+
+    ok = sum(1 for r in results if r.ok)
+    return {
+        "roster": roster,
+        "directory_users": users,
+        "latency_ms": latency * 1000,
+        "page_size": pageSize,
+        "seconds": round(elapsed, 4),
+        "succeeded": ok,
+        "invites_per_sec": round(ok / elapsed, 2) if elapsed else None,
+        "api_requests": api.state.requests,
+        "api_connections": authObj.poolStats(),
+        "emails_received": sink.messages,
+        "twingate_users": sum(1 for r in results if r.twingate == ""),
+        "twingate_requests": twingate.state.requests,
+    }
+
+
+def tapeRoundTrip(roster: int, users: int) -> dict:
+    """
+    Records a batch invite against the fakes, stops the fake Authentik, and
+    replays the tape into a second batch, which must come out the same.
+    """
+
+    try:
+        import authentik_client  # noqa: F401
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    from invite_tool import batch
+    from invite_tool.authentik import Authentik
+    from invite_tool.roster import RosterEntry
+
+    api = FakeAuthentik(AuthentikState(users=users)).start()
+    sink = SMTPSink().start()
+    with tempfile.TemporaryDirectory() as tapeDir:
+        tape = os.path.join(tapeDir, "authentik.jsonl.gz")
+        conf = {
+            "fromAddr": "invites@example.com",
+            "authentik": {
+                "url": api.url,
+                "key": "bench",
+                "tape": tape,
+                "tapeMode": "record",
+            },
+            "mailtrap": {
+                "key": "bench",
+                "host": "127.0.0.1",
+                "port": sink.port,
+                "starttls": False,
+                "rateLimit": 100000,
+                "burst": 1000,
+            },
+        }
+        entries = [
+            RosterEntry(
+                row=i + 1,
+                first=f"tape{i}",
+                last=f"person{i}",
+                email=f"tape{i}@example.com",
+                groups=["plexuser"],
+            )
+            for i in range(roster)
+        ]
+        try:
+            recorder = Authentik(conf["authentik"])
+            recorded = batch.runBatch(recorder, conf, entries)
+            assert recorder.tape is not None
+            recorder.tape.close()
+        finally:
+            api.stop()
+
+        try:
+            conf["authentik"] = dict(
+                conf["authentik"], tapeMode="replay", replaySpeed=0
+            )
+            replayer = Authentik(conf["authentik"])
+            start = time.perf_counter()
+            replayed = batch.runBatch(replayer, conf, entries)
+            elapsed = time.perf_counter() - start
+        finally:
+            sink.stop()
+
+        size = os.path.getsize(tape)
+
+    before = [(r.username, r.ok, r.token) for r in recorded]
+    after = [(r.username, r.ok, r.token) for r in replayed]
+    if before != after:
+        raise AssertionError(f"Replay differs from the recording: {before} != {after}")
+    return {
+        "roster": roster,
+        "directory_users": users,
+        "tape_bytes": size,
+        "requests": api.state.requests,
+        "replay_seconds": round(elapsed, 4),
+        "matched": sum(1 for r in replayed if r.ok),
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Invite Tool against local stand-ins."
+    )
+    parser.add_argument(
+        "--only",
+        choices=("micro", "e2e", "startup", "tape"),
+        help="Run one group of benchmarks.",
+    )
+    parser.add_argument(
+        "-n", type=int, default=20000, help="Iterations per microbenchmark."
+    )
+    parser.add_argument(
+        "--roster", type=int, default=200, help="People invited in the end-to-end run."
+    )
+    parser.add_argument(
+        "--users", type=int, default=5000, help="Existing users in the fake directory."
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=5,
+        help="Milliseconds added to every fake API request.",
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=100, help="Largest page the fake API returns."
+    )
+    parser.add_argument(
+        "--out",
+        default=os.path.join(BENCH_DIR, "results.jsonl"),
+        help="JSON lines file to append to.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as confDir:
+        # phone.yml and the templates fall back to the repo copies
+        with open(os.path.join(confDir, "conf.yml"), "w") as f:
+            f.write(CONF_TEMPLATE.format(url="127.0.0.1", smtpPort=25))
+        os.environ["INVITE_TOOL_CONF_DIR"] = confDir
+
+        results: dict[str, Any] = {}
+        if args.only in (None, "micro"):
+            results["micro"] = microbenchmarks(args.n)
+        if args.only in (None, "startup"):
+            results["startup"] = importTime()
+        if args.only in (None, "e2e"):
+            results["e2e"] = endToEnd(
+                args.roster, args.users, args.latency / 1000, args.page_size
+            )
+        if args.only in (None, "tape"):
+            results["tape"] = tapeRoundTrip(args.roster, args.users)
+
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(json.dumps(results, indent=2))
+    print(f"Appended results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
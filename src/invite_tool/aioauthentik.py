@@ -0,0 +1,105 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+from invite_tool.authentik import Authentik
+from invite_tool.directory import DirectoryIndex
+
+if TYPE_CHECKING:
+    from authentik_client.models.flow import Flow
+    from authentik_client.models.invitation import Invitation
+
+
+class AsyncAuthentik:
+    """
+    Asyncio front end for an Authentik object.
+
+    authentik_client only ships a blocking HTTP client, so each call runs on a
+    worker thread. A semaphore caps how many requests are in flight at once, which
+    lets a batch of invites be created concurrently without flooding the server.
+    The wrapped Authentik object (and its cache) is shared, so the synchronous API
+    keeps working alongside this one.
+    """
+
+    def __init__(self, authObj: Authentik, maxConcurrency: int = 8):
+        self.sync = authObj
+        self.maxConcurrency = maxConcurrency
+        self._limit = asyncio.Semaphore(maxConcurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=maxConcurrency, thread_name_prefix="authentik"
+        )
+
+    @classmethod
+    def fromConf(cls, authConf: dict) -> "AsyncAuthentik":
+        return cls(Authentik(authConf), int(authConf.get("maxConcurrency") or 8))
+
+    async def _call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        async with self._limit:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def fetchGroupList(self) -> list[str]:
+        return await self._call(self.sync.fetchGroupList)
+
+    async def fetchUserList(self) -> list[str]:
+        return await self._call(self.sync.fetchUserList)
+
+    async def fetchInviteFlows(self) -> list["Flow"]:
+        return await self._call(self.sync.fetchInviteFlows)
+
+    async def fetchExistingInvites(self) -> list[str]:
+        return await self._call(self.sync.fetchExistingInvites)
+
+    async def fetchDirectoryIndex(self) -> DirectoryIndex:
+        return await self._call(self.sync.fetchDirectoryIndex)
+
+    async def userExists(self, username: str) -> bool:
+        return await self._call(self.sync.userExists, username)
+
+    async def groupExists(self, name: str) -> bool:
+        return await self._call(self.sync.groupExists, name)
+
+    async def inviteExists(self, user) -> bool:
+        return await self._call(self.sync.inviteExists, user)
+
+    async def createInvite(self, user, flow: "Flow") -> "Invitation":
+        return await self._call(self.sync.createInvite, user, flow)
+
+    async def deleteInvite(self, pk: str):
+        return await self._call(self.sync.deleteInvite, pk)
+
+    async def createInvites(
+        self, pairs: Iterable[tuple[Any, "Flow"]]
+    ) -> list["Invitation | BaseException"]:
+        """
+        Creates an invite for every (user, flow) pair concurrently. Results come back
+        in the same order; a failed invite is returned as its exception rather than
+        cancelling the rest.
+        """
+
+        return await asyncio.gather(
+            *(self.createInvite(user, flow) for user, flow in pairs),
+            return_exceptions=True,
+        )
+
+    async def deleteInvites(self, pks: Iterable[str]) -> list[Any]:
+        """
+        Deletes invites concurrently. Failures are returned in place, as with
+        createInvites.
+        """
+
+        return await asyncio.gather(
+            *(self.deleteInvite(pk) for pk in pks), return_exceptions=True
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncAuthentik":
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
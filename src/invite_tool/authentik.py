@@ -1,35 +1,101 @@
 import datetime
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Iterator
 
-import authentik_client as ac
-from authentik_client.models.flow import Flow
-from authentik_client.models.flow_designation_enum import FlowDesignationEnum
-from authentik_client.models.invitation import Invitation
-from authentik_client.models.invitation_request import InvitationRequest
+from invite_tool import config, metrics, resilience
+from invite_tool.cache import TTLCache
+from invite_tool.directory import DirectoryIndex, inviteName
+from invite_tool.tape import tapeFromConf
+
+# authentik_client pulls in every model and API class when imported, so it is only
+# imported once a request is actually made
+if TYPE_CHECKING:
+    import authentik_client as ac
+    from authentik_client.models.flow import Flow
+    from authentik_client.models.invitation import Invitation
 
 # from user import HomelabUser
 
+# days a new invite stays valid
+INVITE_DAYS = 14
+
 
 class Authentik:
-    def __init__(self, authConf: dict[str, str]):
+    def __init__(self, authConf: dict):
         authConf = authConf
-        # configure API client
-        self.conf = ac.Configuration(
-            host=f"https://{authConf['url']}/api/v3", access_token=authConf["key"]
+        # directory listings are cached for this many seconds; 0 disables caching
+        cacheTTL = authConf.get("cacheTTL")
+        self.cache = TTLCache(60 if cacheTTL is None else float(cacheTTL))
+        # results requested per page when listing users, groups, flows, and invites
+        self.pageSize = int(authConf.get("pageSize") or 100)
+
+        # transient failures (429, 5xx gateway errors, dropped connections) are retried
+        # per request; a breaker shared by every Authentik object fails fast while
+        # the server is down
+        self.retry = resilience.RetryPolicy(
+            attempts=int(authConf.get("retries") or 4),
+            retryable=_retryable,
+            retryAfter=_retryAfter,
+        )
+        self.breaker = resilience.breaker("authentik")
+        # (connect, read) seconds for every request
+        self.timeout = (
+            float(authConf.get("connectTimeout") or 5),
+            float(authConf.get("readTimeout") or 30),
         )
 
+        # records requests to, or answers them from, a tape file if one is configured
+        self.tape = tapeFromConf(authConf)
+
+        self.authConf = authConf
+        self._clientLock = threading.Lock()
+        self._apis: dict[str, Any] | None = None
+
+    def _api(self, name: str) -> Any:
+        """
+        Builds the API client on first use and returns one of its API objects.
+        """
+
+        if self._apis is None:
+            with self._clientLock:
+                if self._apis is None:
+                    self._apis = _sharedClient(self.host, self.authConf)
+        return self._apis[name]
+
+    @staticmethod
+    def _buildClient(host: str, authConf: dict) -> dict[str, Any]:
+        import socket
+
+        import authentik_client as ac
+        from urllib3.connection import HTTPConnection
+
+        # configure API client
+        conf = ac.Configuration(host=host, access_token=authConf["key"])
+
         # set api key
-        self.conf.api_key["authentik"] = authConf["key"]
+        conf.api_key["authentik"] = authConf["key"]
+
+        # one connection per concurrent caller, so none is thrown away for lack of
+        # room in the pool; TCP keep-alive stops idle ones being dropped silently
+        conf.connection_pool_maxsize = int(authConf.get("poolSize") or 16)
+        if authConf.get("keepAlive", True):
+            conf.socket_options = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
 
-        APIClient = ac.ApiClient(self.conf)
+        APIClient = ac.ApiClient(conf)
+        # callers beyond poolSize wait for a connection instead of opening one
+        # that is discarded afterwards
+        APIClient.rest_client.pool_manager.connection_pool_kw["block"] = True
+        if authConf.get("gzip", True):
+            APIClient.set_default_header("Accept-Encoding", "gzip")
 
         # create API objects for each API classification
         # admin = ac.AdminApi(APIClient)
         # authenticators = ac.AuthenticatorsApi(APIClient)
-        self.core = ac.CoreApi(APIClient)
         # crypto = ac.CryptoApi(APIClient)
         # enterprise = ac.EnterpriseApi(APIClient)
         # events = ac.EventsApi(APIClient)
-        self.flows = ac.FlowsApi(APIClient)
         # managed = ac.ManagedApi(APIClient)
         # oauth2 = ac.Oauth2Api(APIClient)
         # outposts = ac.OutpostsApi(APIClient)
@@ -41,38 +107,141 @@ class Authentik:
         # root = ac.RootApi(APIClient)
         # schema = ac.SchemaApi(APIClient)
         # sources = ac.SourcesApi(APIClient)
-        self.stages = ac.StagesApi(APIClient)
         # tenants = ac.TenantsApi(APIClient)
+        return {
+            "conf": conf,
+            "client": APIClient,
+            "core": ac.CoreApi(APIClient),
+            "flows": ac.FlowsApi(APIClient),
+            "stages": ac.StagesApi(APIClient),
+        }
+
+    @property
+    def conf(self) -> "ac.Configuration":
+        return self._api("conf")
+
+    @property
+    def core(self) -> "ac.CoreApi":
+        return self._api("core")
+
+    @property
+    def flows(self) -> "ac.FlowsApi":
+        return self._api("flows")
+
+    @property
+    def stages(self) -> "ac.StagesApi":
+        return self._api("stages")
+
+    @property
+    def host(self) -> str:
+        """
+        API URL, available without building the client.
+        """
+
+        url = self.authConf["url"]
+        # a scheme is normally left out of conf.yml, but may be given to reach a
+        # plain-HTTP server such as the benchmark stand-in
+        if "://" not in url:
+            url = f"https://{url}"
+        return f"{url}/api/v3"
+
+    def _call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Makes one API call, through the tape if there is one.
+        """
+
+        kwargs.setdefault("_request_timeout", self.timeout)
+        if self.tape is None:
+            return func(*args, **kwargs)
+        return self.tape.call(
+            getattr(func, "__name__", "request"), func, *args, **kwargs
+        )
+
+    def _request(
+        self, func: Callable[..., Any], *args, beforeRetry=None, **kwargs
+    ) -> Any:
+        endpoint = getattr(func, "__name__", "request")
+
+        def timed(*args, **kwargs):
+            with metrics.authentikLatency.time(endpoint=endpoint):
+                return self._call(func, *args, **kwargs)
+
+        return resilience.call(
+            timed,
+            *args,
+            policy=self.retry,
+            breaker=self.breaker,
+            beforeRetry=beforeRetry,
+            **kwargs,
+        )
 
     def fetchGroupList(self) -> list[str]:
-        # grab results section of the raw ouput
-        raw = self.core.core_groups_list().results
+        return list(self.cache.get("groups", self._fetchGroupList))
 
-        # make a list of all the group names
-        groups = [g.name for g in raw]
-        # print(groups)
-        return groups
+    def _fetchGroupList(self) -> list[str]:
+        return [g.name for g in self.iterGroups()]
 
     def fetchUserList(self) -> list[str]:
-        # grab results section of the raw ouput
-        raw = self.core.core_users_list().results
+        return list(self.cache.get("users", self._fetchUserList))
+
+    def _fetchUserList(self) -> list[str]:
+        return [u.username for u in self.iterUsers()]
+
+    def fetchInviteFlows(self) -> list["Flow"]:
+        return list(self.cache.get("flows", self._fetchInviteFlows))
+
+    def _fetchInviteFlows(self) -> list["Flow"]:
+        from authentik_client.models.flow_designation_enum import FlowDesignationEnum
+
+        return list(self.iterFlows(designation=FlowDesignationEnum.ENROLLMENT.value))
 
-        # make a list of usernames from the authentik_client.User object
-        users = [u.username for u in raw]
-        # print(users)
-        return users
+    def _paginate(self, listFunc: Callable[..., Any], **kwargs) -> Iterator[Any]:
+        """
+        Yields every result of a paginated list endpoint, one page at a time, so
+        only a single page is ever held in memory.
+        """
+
+        page = 1
+        while True:
+            raw = self._request(listFunc, page=page, page_size=self.pageSize, **kwargs)
+            yield from raw.results
 
-    def fetchInviteFlows(self) -> list[Flow]:
-        raw: list[Flow] = self.flows.flows_instances_list().results
-        enrollmentFlows = []
+            # authentik reports 0 as the next page once the last page is reached
+            nextPage = raw.pagination.next
+            if not nextPage:
+                return
+            page = int(nextPage)
 
-        for flow in raw:
-            if flow.designation == FlowDesignationEnum.ENROLLMENT:
-                enrollmentFlows.append(flow)
+    def iterGroups(self, **kwargs) -> Iterator[Any]:
+        return self._paginate(self.core.core_groups_list, **kwargs)
 
-        # a: Flow = enrollmentFlows[0]
+    def iterUsers(self, **kwargs) -> Iterator[Any]:
+        return self._paginate(self.core.core_users_list, **kwargs)
 
-        return enrollmentFlows
+    def iterFlows(self, **kwargs) -> Iterator["Flow"]:
+        return self._paginate(self.flows.flows_instances_list, **kwargs)
+
+    def iterInvites(self, **kwargs) -> Iterator["Invitation"]:
+        return self._paginate(self.stages.stages_invitation_invitations_list, **kwargs)
+
+    def _first(self, listFunc: Callable[..., Any], **filters) -> Any:
+        """
+        First result of a list endpoint narrowed by query parameters, or None. One
+        request of at most one result, however big the directory is.
+        """
+
+        # the API ignores a blank filter and would return an arbitrary first row
+        if any(str(value).strip() == "" for value in filters.values()):
+            return None
+
+        raw = self._request(listFunc, page=1, page_size=1, **filters)
+        return raw.results[0] if raw.results else None
+
+    def userExists(self, username: str) -> bool:
+        return self._first(self.core.core_users_list, username=username) is not None
+
+    def groupExists(self, name: str) -> bool:
+        return self._first(self.core.core_groups_list, name=name) is not None
 
     def shiftDate(self, ref: datetime.datetime, days: int) -> datetime.datetime:
         return ref + datetime.timedelta(days=days)
@@ -82,35 +251,162 @@ class Authentik:
         Fetches existing, unused invites.
         """
 
-        raw: list[Invitation] = self.stages.stages_invitation_invitations_list().results
+        return list(self.cache.get("invites", self._fetchExistingInvites))
 
-        names = [a.name for a in raw]
-        return names
+    def _fetchExistingInvites(self) -> list[str]:
+        return [a.name for a in self.iterInvites()]
 
-    def inviteExists(self, user):
-        existing = self.fetchExistingInvites()
-        for a in existing:
-            if a[:-7] == user.username:
-                return True
-            else:
-                return False
+    def fetchDirectoryIndex(self) -> DirectoryIndex:
+        """
+        Fetches users, groups, and invites into a hash index for constant-time
+        existence checks.
+        """
+
+        return self.cache.get("index", lambda: DirectoryIndex.fromAuthentik(self))
 
-        if len(existing) == 0:
-            return False
+    def inviteExists(self, user) -> bool:
+        """
+        Checks for the invite this tool would have made for a user. Use a
+        DirectoryIndex to check many users, or to also catch invites made by hand.
+        """
 
-    def createInvite(self, user, flow: Flow):
+        found = self._first(
+            self.stages.stages_invitation_invitations_list,
+            name=inviteName(user.username),
+        )
+        return found is not None
+
+    def createInvite(self, user, flow: "Flow"):
         today = datetime.datetime.today()
-        expires = self.shiftDate(today, +14)
+        expires = self.shiftDate(today, +INVITE_DAYS)
+
+        from authentik_client.models.invitation_request import InvitationRequest
 
         data = user.createAuthInviteData()
         data["invite_expires"] = str(expires)
 
+        name = inviteName(user.username)
         invite = InvitationRequest(
-            name=f"{user.username}-invite",
+            name=name,
             expires=expires,
             fixed_data=data,
             single_use=True,
             flow=flow.pk,
         )
 
-        return self.stages.stages_invitation_invitations_create(invite)
+        try:
+            created = self._request(
+                self.stages.stages_invitation_invitations_create,
+                invite,
+                # a gateway error doesn't mean the invite wasn't made; look before
+                # creating it a second time
+                beforeRetry=lambda e: self._findInvite(name),
+            )
+        except BaseException:
+            # the invite may or may not have been made before the request failed
+            self.cache.invalidate("invites", "index")
+            raise
+
+        metrics.invitesCreated.inc()
+        # keep a warm index warm rather than refetching the whole directory
+        if not self.cache.update("index", lambda index: index.withInvite(created)):
+            self.cache.invalidate("index")
+        self.cache.invalidate("invites")
+        return created
+
+    def _findInvite(self, name: str) -> "Invitation | None":
+        try:
+            found = self._call(
+                self.stages.stages_invitation_invitations_list, name=name
+            ).results
+        except Exception:
+            return None
+        return found[0] if found else None
+
+    def deleteInvite(self, pk: str):
+        try:
+            self._request(
+                self.stages.stages_invitation_invitations_destroy, invite_uuid=pk
+            )
+        finally:
+            self.cache.invalidate("invites", "index")
+
+    def poolStats(self) -> dict[str, int]:
+        """
+        Requests made over the shared connection pool and connections opened for
+        them; reused is how many requests found a connection already open.
+        """
+
+        if self._apis is None:
+            return {"requests": 0, "connections": 0, "reused": 0}
+
+        pools = self._apis["client"].rest_client.pool_manager.pools
+        requests = connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests += pool.num_requests
+                connections += pool.num_connections
+        return {
+            "requests": requests,
+            "connections": connections,
+            "reused": requests - connections,
+        }
+
+    def invalidateCache(self, *keys: str):
+        """
+        Forgets cached directory listings ("users", "groups", "flows", "invites",
+        "index"), or all of them if no keys are given.
+        """
+
+        self.cache.invalidate(*keys)
+
+
+def _retryable(e: BaseException) -> bool:
+    from authentik_client.exceptions import ApiException
+    from urllib3.exceptions import HTTPError
+
+    if isinstance(e, ApiException):
+        return e.status in (429, 502, 503, 504)
+    return isinstance(e, (HTTPError, ConnectionError, TimeoutError))
+
+
+def _retryAfter(e: BaseException) -> float | None:
+    if getattr(e, "status", None) not in (429, 503):
+        return None
+    headers = getattr(e, "headers", None) or {}
+    return resilience.parseRetryAfter(headers.get("Retry-After"))
+
+
+_clients: dict[tuple[str, str], dict[str, Any]] = {}
+_clientsLock = threading.Lock()
+
+
+def _sharedClient(host: str, authConf: dict) -> dict[str, Any]:
+    """
+    The process-wide API client for a server and key. Every Authentik object
+    talking to the same server shares its connection pool.
+    """
+
+    key = (host, str(authConf["key"]))
+    with _clientsLock:
+        if key not in _clients:
+            _clients[key] = Authentik._buildClient(host, authConf)
+        return _clients[key]
+
+
+_shared: Authentik | None = None
+_sharedLock = threading.Lock()
+
+
+def sharedAuthentik() -> Authentik:
+    """
+    The process-wide Authentik object, configured from conf.yml on first use.
+    """
+
+    global _shared
+    if _shared is None:
+        with _sharedLock:
+            if _shared is None:
+                _shared = Authentik(config.loadConf()["authentik"])
+    return _shared
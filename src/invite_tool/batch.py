@@ -0,0 +1,506 @@
+import contextlib
+import copy
+import queue
+import threading
+from typing import TYPE_CHECKING
+
+from invite_tool.authentik import Authentik
+from invite_tool.directory import DirectoryIndex
+from invite_tool.dispatch import Dispatcher
+from invite_tool.invite import InviteEmail
+from invite_tool.journal import (
+    INVITED,
+    PLANNED,
+    RENDERED,
+    SENT,
+    Journal,
+    JournalRecord,
+    rowKey,
+)
+from invite_tool.mail import AddressIndex, DuplicateEmailError, InvalidEmailError
+from invite_tool.phone import format_many
+from invite_tool.roster import RosterEntry
+from invite_tool.smtp import SMTPPool
+from invite_tool.spool import Spool
+from invite_tool.twingate import Twingate
+from invite_tool.user import ExistsError, HomelabUser, usernameFormat, validateUser
+from invite_tool.username import resolveUsernames
+
+if TYPE_CHECKING:
+    from authentik_client.models.flow import Flow
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class DirectorySnapshot:
+    """
+    Directory index and invite flows for one batch, taken from the Authentik
+    object's cache. Concurrent batches share a single fetch.
+    """
+
+    def __init__(self, authObj: Authentik):
+        self.index: DirectoryIndex = authObj.fetchDirectoryIndex()
+        self.flows: list["Flow"] = authObj.fetchInviteFlows()
+
+    def inviteExists(self, user: HomelabUser) -> bool:
+        return self.index.inviteExists(user.username)
+
+    def findFlow(self, name: str) -> "Flow":
+        """
+        Finds an enrollment flow by name or slug. An empty name is only allowed if
+        there is exactly one enrollment flow.
+        """
+
+        if name == "":
+            if len(self.flows) == 1:
+                return self.flows[0]
+            raise ValueError("No flow given and more than one enrollment flow exists.")
+
+        for flow in self.flows:
+            if name in (flow.name, flow.slug):
+                return flow
+
+        raise ValueError(f"Unknown invite flow {name}.")
+
+
+class UsernameClaims:
+    """
+    Usernames held by batches still in progress. Concurrent batches sharing one
+    of these can't both pick a name before either invite exists.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names: set[str] = set()
+
+
+class RowResult:
+    """
+    Outcome of one roster row.
+    """
+
+    def __init__(self, entry: RosterEntry):
+        self.entry = entry
+        self.username = ""
+        self.stage = "validate"
+        self.ok = False
+        self.error = ""
+        self.token = ""
+        self.key = rowKey(entry.email, entry.row)
+        self.resumed = False
+        # None when the row doesn't get Twingate, "" once it has, else the error
+        self.twingate: str | None = None
+
+    def toDict(self) -> dict:
+        return {
+            "row": self.entry.row,
+            "username": self.username,
+            "ok": self.ok,
+            "stage": self.stage,
+            "error": self.error,
+            "token": self.token,
+            "resumed": self.resumed,
+            "twingate": self.twingate,
+        }
+
+    def fail(self, stage: str, error: Exception | str):
+        self.stage = stage
+        self.ok = False
+        self.error = str(error)
+
+    def __str__(self) -> str:
+        return self._authentikLine() + self._twingateNote()
+
+    def _authentikLine(self) -> str:
+        row = f"row {self.entry.row}"
+        who = self.username or self.entry.email or row
+        if self.ok and self.resumed:
+            return (
+                f"{row}: {who} already invited in an earlier run (token {self.token})"
+            )
+        if self.ok and self.stage == "queued":
+            return f"{row}: {who} invited (token {self.token}), email queued"
+        if self.ok:
+            return f"{row}: {who} invited (token {self.token})"
+        return f"{row}: {who} FAILED at {self.stage}: {self.error}"
+
+    def _twingateNote(self) -> str:
+        if self.twingate is None:
+            return ""
+        if self.twingate == "":
+            return "; added to Twingate"
+        return f"; Twingate FAILED: {self.twingate}"
+
+
+def _buildUser(
+    entry: RosterEntry,
+    username: str,
+    phone: str,
+    directory: DirectorySnapshot,
+    seen: set[str],
+    adopting: bool = False,
+) -> HomelabUser:
+    user = HomelabUser(
+        entry.first,
+        entry.last,
+        entry.email,
+        entry.groups,
+        middleName=entry.middleName,
+        middleInitial=entry.middleInitial,
+        username=username,
+    )
+    # the roster's phone column is formatted in one pass before any user is built
+    user.phone = phone
+    validateUser(user, directory.index)
+
+    if user.username in seen:
+        raise ExistsError(f"User {user.username} appears more than once in the roster.")
+    # a pending invite is expected when picking up a row from an earlier run
+    if not adopting and directory.inviteExists(user):
+        raise ExistsError(f"Invite for {user.username} already exists.")
+
+    seen.add(user.username)
+    return user
+
+
+def runBatch(
+    authObj: Authentik,
+    conf: dict,
+    entries: list[RosterEntry],
+    createWorkers: int = 4,
+    journal: Journal | None = None,
+    dispatcher: Dispatcher | None = None,
+    claims: UsernameClaims | None = None,
+    spool: Spool | None = None,
+) -> list[RowResult]:
+    """
+    Invites everyone in a roster without prompting.
+
+    Rows are validated on the calling thread, then handed to a pool of invite
+    creators, whose output is rendered and queued on a rate-limited Dispatcher.
+    Emails for early rows go out while later rows are still being created in
+    Authentik.
+
+    With a journal, each row's progress is recorded as it goes, and rows it
+    already has are picked up where they stopped: sent rows are skipped, and rows
+    whose invite exists are emailed without creating another one.
+
+    A long-running caller can pass its own Dispatcher, which is left open; the
+    batch still waits for its own emails before returning. Callers running
+    batches side by side share one UsernameClaims between them.
+
+    With a spool, emails are only written to it, and the batch finishes at
+    Authentik's pace; a SpoolDeliverer sends them separately.
+
+    If Twingate is configured, new users in its groups are added to the network
+    on another thread while their invites are created, in batched requests. Its
+    outcome is reported per row apart from the invite's, so either can fail
+    alone. Rows picked up from a journal are not sent to Twingate again.
+    """
+
+    directory = DirectorySnapshot(authObj)
+    twingate = Twingate.fromConf(conf.get("twingate"))
+    provisioning: threading.Thread | None = None
+    transport = None
+    if dispatcher is None and spool is None:
+        transport = SMTPPool.fromConf(conf["mailtrap"])
+        dispatcher = Dispatcher.fromConf(conf["mailtrap"], transport)
+    # set once each email's outcome has been recorded
+    deliveries: list[threading.Event] = []
+    results = [RowResult(e) for e in entries]
+    records: dict[str, JournalRecord] = journal.load() if journal is not None else {}
+
+    keys: set[str] = set()
+    for result in results:
+        # the same address twice in one roster still needs two journal rows
+        if result.key in keys:
+            result.key = f"{result.key} #{result.entry.row}"
+        keys.add(result.key)
+
+    def note(
+        result: RowResult, state: str, invite=None, error: Exception | None = None
+    ):
+        if journal is None:
+            return
+        journal.record(
+            result.key,
+            result.username,
+            state,
+            invitePk=str(invite.pk) if invite is not None else None,
+            expires=str(invite.expires) if invite is not None else None,
+            error=str(error) if error is not None else None,
+            # sent rows go to disk at once, or a crash before the next flush would
+            # have a rerun email them again
+            flush=state == SENT,
+        )
+
+    createQueue: queue.Queue = queue.Queue(maxsize=createWorkers * 4)
+    sendQueue: queue.Queue = queue.Queue(maxsize=createWorkers * 4)
+
+    def creator():
+        while True:
+            item = createQueue.get()
+            if item is _DONE:
+                return
+            result, user, flow = item
+            try:
+                result.stage = "invite"
+                invite = authObj.createInvite(user, flow)
+            except Exception as e:
+                result.fail("invite", e)
+                note(result, PLANNED, error=e)
+                continue
+            result.token = str(invite.pk)
+            note(result, INVITED, invite)
+            sendQueue.put((result, user, flow, invite))
+
+    def delivered(
+        result: RowResult, inviteEmail: InviteEmail, done: threading.Event, future
+    ):
+        try:
+            error = future.exception()
+            if error is not None:
+                result.fail("email", error)
+                note(result, RENDERED, error=error)
+                return
+            note(result, SENT)
+            result.stage = "done"
+            result.ok = True
+            inviteEmail.remind()
+        finally:
+            done.set()
+
+    def renderer():
+        while True:
+            item = sendQueue.get()
+            if item is _DONE:
+                return
+            result, user, flow, invite = item
+            try:
+                result.stage = "email"
+                inviteEmail = InviteEmail(
+                    user=user,
+                    fromAddress=conf["fromAddr"],
+                    invite=invite,
+                    flow=flow,
+                    authURL=conf["authentik"]["url"],
+                )
+                message = inviteEmail.message
+            except Exception as e:
+                result.fail("email", e)
+                note(result, INVITED, error=e)
+                continue
+            if spool is not None:
+                try:
+                    spool.put(message)
+                except OSError as e:
+                    result.fail("email", e)
+                    note(result, INVITED, error=e)
+                    continue
+                # the spool owns delivery from here, so a rerun must not send again
+                note(result, SENT)
+                result.stage = "queued"
+                result.ok = True
+                inviteEmail.remind()
+                continue
+
+            note(result, RENDERED)
+            done = threading.Event()
+            deliveries.append(done)
+            assert dispatcher is not None
+            future = dispatcher.submit(inviteEmail.fromAddr, user.email, message)
+            future.add_done_callback(
+                lambda f, r=result, m=inviteEmail, d=done: delivered(r, m, d, f)
+            )
+
+    # rows finished in an earlier run are done; every other address is checked
+    # in one pass, so invalid and duplicate rows cost no API calls or sends.
+    # Addresses with a pending invite count as taken, except for the journaled
+    # rows those invites were made for.
+    journaled = {record.username for record in records.values()}
+    existing = {
+        key: f"{username} (invited)"
+        for key, username in directory.index.inviteEmails.items()
+        if username not in journaled
+    }
+    existing.update(directory.index.emails)
+    addresses = AddressIndex(existing)
+    seen: set[str] = set()
+    pending: list[RowResult] = []
+    resumed = set()
+    for result in results:
+        record = records.get(result.key)
+        if record is not None and record.reached(SENT):
+            result.username = record.username
+            result.token = record.invitePk or ""
+            result.stage = "done"
+            result.ok = True
+            result.resumed = True
+            seen.add(record.username)
+            # a later row can't be sent to the same person again
+            addresses.reserve(result.entry.email, f"row {result.entry.row}")
+            resumed.add(result.key)
+
+    for result in results:
+        if result.key in resumed:
+            continue
+        missing = result.entry.missing()
+        if missing:
+            result.fail("validate", f"No {', '.join(missing)} given.")
+            continue
+        try:
+            addresses.add(result.entry.email, f"row {result.entry.row}")
+        except (InvalidEmailError, DuplicateEmailError) as e:
+            result.fail("validate", e)
+            continue
+        pending.append(result)
+
+    # settle every generated username up front so clashes within the roster get
+    # numbered instead of failing. Journaled rows keep the username they had.
+    people = []
+    for result in pending:
+        record = records.get(result.key)
+        person = result.entry
+        if record is not None and not person.username:
+            person = copy.copy(person)
+            person.username = record.username
+        people.append(person)
+    busy: set[str] = set()
+    mine: list[str] = []
+    with claims.lock if claims is not None else contextlib.nullcontext():
+        if claims is not None:
+            busy = set(claims.names)
+        usernames = resolveUsernames(
+            people,
+            usernameFormat(),
+            lambda name: directory.index.usernameTaken(name) or name in busy,
+        )
+        if claims is not None:
+            mine = [u for u in usernames if u and u not in busy]
+            claims.names.update(mine)
+
+    # the workers start only once nothing above can fail, so the finally below
+    # always gets to stop them
+    creators = [threading.Thread(target=creator) for _ in range(createWorkers)]
+    rendering = threading.Thread(target=renderer)
+    for t in creators + [rendering]:
+        t.start()
+
+    try:
+        toCreate = []
+        toSend = []
+        phones = format_many(result.entry.phone for result in pending)
+        for result, username, phone in zip(pending, usernames, phones):
+            record = records.get(result.key)
+
+            # an invite from an earlier run, possibly made just before it died
+            # and never journaled, is reused instead of created again
+            invite = (
+                directory.index.pendingInvite(username) if record is not None else None
+            )
+            try:
+                if not username:
+                    raise ValueError("No username can be made from this name.")
+                if isinstance(phone, ValueError):
+                    raise phone
+                if username in busy:
+                    raise ExistsError(
+                        f"User {username} is being invited by another batch."
+                    )
+                flow = directory.findFlow(result.entry.flow)
+                user = _buildUser(
+                    result.entry,
+                    username,
+                    phone,
+                    directory,
+                    seen,
+                    adopting=invite is not None,
+                )
+            except Exception as e:
+                result.fail("validate", e)
+                continue
+            result.username = user.username
+
+            if invite is not None:
+                result.token = str(invite.pk)
+                note(result, INVITED, invite)
+                toSend.append((result, user, flow, invite))
+            else:
+                note(result, PLANNED)
+                toCreate.append((result, user, flow))
+
+        # every username must be on disk before its invite can exist, or a rerun
+        # could not tell the invite was ours
+        if journal is not None:
+            journal.flush()
+
+        if twingate is not None:
+            # a journaled row may have reached Twingate before its run stopped
+            wanted = [
+                (result, user)
+                for result, user, _ in toCreate
+                if result.key not in records and twingate.wants(user)
+            ]
+            if wanted:
+                provisioning = threading.Thread(
+                    target=_provision, args=(twingate, wanted)
+                )
+                provisioning.start()
+
+        for item in toSend:
+            sendQueue.put(item)
+        for item in toCreate:
+            createQueue.put(item)
+
+    finally:
+        for _ in creators:
+            createQueue.put(_DONE)
+        for t in creators:
+            t.join()
+        if claims is not None:
+            # the invites are in the directory index (or it was dropped) by now
+            with claims.lock:
+                claims.names.difference_update(mine)
+
+        sendQueue.put(_DONE)
+        rendering.join()
+        if provisioning is not None:
+            provisioning.join()
+
+        # a future's waiters wake before its callbacks run, so wait on the
+        # callbacks themselves
+        for done in deliveries:
+            done.wait()
+        if transport is not None:
+            dispatcher.close()
+            transport.close()
+            print(f"Email delivery: {dispatcher.stats()}")
+        if journal is not None:
+            journal.flush()
+
+    return results
+
+
+def _provision(twingate: Twingate, wanted: list[tuple[RowResult, HomelabUser]]):
+    try:
+        outcomes = twingate.createUsers([user for _, user in wanted])
+    except Exception as e:
+        outcomes = [e] * len(wanted)
+    for (result, _), outcome in zip(wanted, outcomes):
+        result.twingate = str(outcome) if isinstance(outcome, Exception) else ""
+
+
+def summary(results: list[RowResult]) -> str:
+    succeeded = sum(1 for r in results if r.ok)
+    lines = [str(r) for r in results]
+    lines.append(
+        f"\n{succeeded} of {len(results)} invites sent, {len(results) - succeeded} failed."
+    )
+    twingate = [r for r in results if r.twingate is not None]
+    if twingate:
+        added = sum(1 for r in twingate if r.twingate == "")
+        lines.append(
+            f"{added} of {len(twingate)} added to Twingate, {len(twingate) - added} failed."
+        )
+    return "\n".join(lines)
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Any, Callable
+
+
+class _Flight:
+    """
+    A fetch that is currently running. Other callers wait on it instead of starting
+    their own.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+
+class TTLCache:
+    """
+    Thread-safe cache of fetched values with a time-to-live.
+
+    Concurrent misses for the same key share a single call to the loader
+    (single-flight), so a burst of callers costs one round trip. A TTL of 0
+    disables caching but keeps the single-flight behavior.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._flights: dict[str, _Flight] = {}
+        # bumped on invalidation so fetches that started earlier don't store stale data
+        self._generation: dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self.hits += 1
+                return entry[1]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.misses += 1
+            generation = self._generation.get(key, 0)
+
+        assert flight is not None
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                stale = self._generation.get(key, 0) != generation
+                if flight.error is None and self.ttl > 0 and not stale:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+            flight.done.set()
+
+        return flight.value
+
+    def update(self, key: str, func: Callable[[Any], Any]) -> bool:
+        """
+        Replaces a cached value with func(value), e.g. to record a change the
+        caller just made without refetching. func must return a new value rather
+        than change the old one, which other threads may be reading. Returns
+        False, leaving it to the caller to invalidate, if the value is missing,
+        expired, or being fetched.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[0] or key in self._flights:
+                return False
+            self._entries[key] = (entry[0], func(entry[1]))
+            return True
+
+    def invalidate(self, *keys: str):
+        """
+        Drops the given keys, or everything if no keys are given.
+        """
+
+        with self._lock:
+            if not keys:
+                keys = tuple(set(self._entries) | set(self._flights))
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generation[key] = self._generation.get(key, 0) + 1
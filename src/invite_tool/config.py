@@ -0,0 +1,55 @@
+import functools
+import os
+
+import yaml
+
+# set to point at a conf directory other than ./conf or the one in the repo
+CONF_DIR_ENV = "INVITE_TOOL_CONF_DIR"
+
+_REPO_CONF_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "conf")
+)
+
+
+def confDir() -> str:
+    """
+    Directory holding conf.yml and phone.yml.
+
+    Uses $INVITE_TOOL_CONF_DIR if set, then ./conf if it exists, then the conf
+    directory of the repo this package lives in, so the tool works when it isn't
+    run from the repo root.
+    """
+
+    env = os.environ.get(CONF_DIR_ENV)
+    if env:
+        return env
+    if os.path.isdir("./conf"):
+        return "./conf"
+    return _REPO_CONF_DIR
+
+
+def confPath(name: str = "conf.yml") -> str:
+    return os.path.join(confDir(), name)
+
+
+def sharedPath(name: str) -> str:
+    """
+    Path of a file that ships with the repo, such as phone.yml or the email
+    templates. A copy in the active conf directory takes precedence.
+    """
+
+    local = confPath(name)
+    if os.path.exists(local):
+        return local
+    return os.path.join(_REPO_CONF_DIR, name)
+
+
+@functools.cache
+def loadConf() -> dict:
+    """
+    Reads conf.yml the first time it is needed. Call loadConf.cache_clear() after
+    rewriting it.
+    """
+
+    with open(confPath(), "r") as f:
+        return yaml.safe_load(f) or {}
@@ -0,0 +1,113 @@
+import copy
+from typing import TYPE_CHECKING, Any, Iterable
+
+from invite_tool.mail import emailKey
+
+if TYPE_CHECKING:
+    from authentik_client.models.invitation import Invitation
+
+INVITE_SUFFIX = "-invite"
+
+
+def inviteName(username: str) -> str:
+    """
+    Name given to the invitation created for a username.
+    """
+
+    return f"{username}{INVITE_SUFFIX}"
+
+
+class DirectoryIndex:
+    """
+    Hash index over a snapshot of the Authentik directory.
+
+    Maps usernames to users, usernames to pending invites, group names to
+    groups, and case-folded email addresses to the usernames of users and of
+    pending invites, so existence checks are dictionary lookups rather than list
+    scans or network calls. Build it once and reuse it for every row of a roster.
+    """
+
+    def __init__(
+        self,
+        users: Iterable[Any] = (),
+        groups: Iterable[Any] = (),
+        invites: Iterable["Invitation"] = (),
+    ):
+        self.users: dict[str, Any] = {u.username: u for u in users}
+        self.emails: dict[str, str] = {
+            emailKey(u.email): u.username
+            for u in self.users.values()
+            if getattr(u, "email", "")
+        }
+        self.groups: dict[str, Any] = {g.name: g for g in groups}
+        self.invites: dict[str, "Invitation"] = {}
+        self.inviteEmails: dict[str, str] = {}
+        for invite in invites:
+            self.addInvite(invite)
+
+    @classmethod
+    def fromAuthentik(cls, authObj) -> "DirectoryIndex":
+        return cls(
+            users=authObj.iterUsers(),
+            groups=authObj.iterGroups(),
+            invites=authObj.iterInvites(),
+        )
+
+    def addInvite(self, invite: "Invitation"):
+        """
+        Records a pending invite, e.g. one just created, without rebuilding the index.
+        """
+
+        username = _inviteUsername(invite)
+        if username:
+            self.invites[username] = invite
+            fixedData = getattr(invite, "fixed_data", None) or {}
+            if fixedData.get("email"):
+                self.inviteEmails[emailKey(str(fixedData["email"]))] = username
+
+    def withInvite(self, invite: "Invitation") -> "DirectoryIndex":
+        """
+        A copy of the index with one more pending invite, leaving this one as it
+        was for whoever is still reading it.
+        """
+
+        index = copy.copy(self)
+        index.invites = dict(self.invites)
+        index.inviteEmails = dict(self.inviteEmails)
+        index.addInvite(invite)
+        return index
+
+    def userExists(self, username: str) -> bool:
+        return username in self.users
+
+    def groupExists(self, name: str) -> bool:
+        return name in self.groups
+
+    def pendingInvite(self, username: str) -> "Invitation | None":
+        return self.invites.get(username)
+
+    def inviteExists(self, username: str) -> bool:
+        return username in self.invites
+
+    def usernameTaken(self, username: str) -> bool:
+        """
+        True if the username belongs to a user or to a pending invite.
+        """
+
+        return username in self.users or username in self.invites
+
+    def userNames(self) -> list[str]:
+        return list(self.users)
+
+    def groupNames(self) -> list[str]:
+        return list(self.groups)
+
+
+def _inviteUsername(invite: "Invitation") -> str:
+    name = invite.name or ""
+    if name.endswith(INVITE_SUFFIX):
+        return name[: -len(INVITE_SUFFIX)]
+
+    # invites not made by this tool may still carry the username in their data
+    fixedData = getattr(invite, "fixed_data", None) or {}
+    return str(fixedData.get("username", ""))
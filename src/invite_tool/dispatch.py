@@ -0,0 +1,273 @@
+import queue
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from email.message import Message
+
+from invite_tool import metrics, resilience
+from invite_tool.smtp import SMTPPool, retryable
+
+# default send limits per provider, used when conf.yml doesn't set its own
+PROVIDER_LIMITS: dict[str, dict[str, float]] = {
+    "mailtrap": {"rate": 5, "burst": 10},
+}
+
+_STOP = object()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill at `rate` per second up to `burst`;
+    each acquire() takes one, blocking until it is available.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._pausedUntil = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._pausedUntil:
+                    wait = self._pausedUntil - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out tokens for a while, e.g. after the provider says to slow down.
+        """
+
+        with self._lock:
+            self._pausedUntil = max(self._pausedUntil, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class _Job:
+    def __init__(
+        self, fromAddr: str, toAddrs: str | list[str], message: str | bytes | Message
+    ):
+        self.fromAddr = fromAddr
+        self.toAddrs = toAddrs
+        self.message = message
+        self.future: Future = Future()
+        self.attempts = 0
+
+
+class DispatchStats:
+    def __init__(self, sent: int, failed: int, retries: int, elapsed: float):
+        self.sent = sent
+        self.failed = failed
+        self.retries = retries
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self) -> float:
+        """
+        Messages delivered per second of sending.
+        """
+
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.sent} sent, {self.failed} failed, {self.retries} retries "
+            f"in {self.elapsed:.1f}s ({self.throughput:.2f} msg/s)"
+        )
+
+
+def _classify(e: BaseException) -> str:
+    """
+    Returns "throttle" for 4xx replies (the provider wants us to slow down),
+    "transient" for dropped connections or an open breaker, and "fatal" for
+    everything else.
+    """
+
+    if isinstance(e, resilience.CircuitOpenError):
+        return "transient"
+    if not retryable(e):
+        return "fatal"
+    if isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+        return "throttle"
+    return "transient"
+
+
+class Dispatcher:
+    """
+    Sends queued messages from a pool of worker threads under a token-bucket rate
+    limit.
+
+    4xx replies pause the whole bucket with exponential backoff, since they usually
+    mean the provider is throttling us. Those, and dropped connections, are retried
+    with jitter up to maxRetries times. Anything else fails the message right away.
+    """
+
+    def __init__(
+        self,
+        transport: SMTPPool,
+        rate: float = 5,
+        burst: float = 10,
+        workers: int = 4,
+        maxRetries: int = 4,
+        backoff: float = 2,
+        maxBackoff: float = 60,
+    ):
+        self.transport = transport
+        self.bucket = TokenBucket(rate, burst)
+        # retries are scheduled here rather than in resilience.call, but the
+        # breaker is the same one InviteEmail uses
+        self.breaker = resilience.breaker("smtp")
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._started: float | None = None
+        self._finished = 0.0
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"dispatch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    @classmethod
+    def fromConf(
+        cls, mailConf: dict, transport: SMTPPool, provider: str = "mailtrap"
+    ) -> "Dispatcher":
+        limits = PROVIDER_LIMITS.get(provider, {"rate": 1, "burst": 1})
+        return cls(
+            transport,
+            rate=float(mailConf.get("rateLimit") or limits["rate"]),
+            burst=float(mailConf.get("burst") or limits["burst"]),
+            workers=int(mailConf.get("sendWorkers") or 4),
+        )
+
+    def submit(
+        self, fromAddr: str, toAddrs: str | list[str], message: str | bytes | Message
+    ) -> Future:
+        """
+        Queues a message. The returned future resolves once it is delivered, or
+        holds the last error if it could not be.
+        """
+
+        job = _Job(fromAddr, toAddrs, message)
+        self._queue.put(job)
+        return job.future
+
+    def send(
+        self, fromAddr: str, toAddrs: str | list[str], message: str | bytes | Message
+    ):
+        """
+        Queues a message and waits for it to be delivered. Lets a Dispatcher be used
+        anywhere an SMTPPool is.
+        """
+
+        self.submit(fromAddr, toAddrs, message).result()
+
+    def _delay(self, attempts: int) -> float:
+        return min(
+            self.maxBackoff, self.backoff * 2 ** (attempts - 1)
+        ) * random.uniform(0.5, 1.5)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._attempt(job)
+            finally:
+                self._queue.task_done()
+
+    def _attempt(self, job: _Job):
+        self.bucket.acquire()
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+
+        job.attempts += 1
+        try:
+            self.breaker.before()
+            try:
+                self.transport.send(job.fromAddr, job.toAddrs, job.message)
+            except Exception as e:
+                if retryable(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                raise
+            self.breaker.success()
+
+        except Exception as e:
+            kind = _classify(e)
+            if kind == "fatal" or job.attempts > self.maxRetries:
+                metrics.failures.inc(service="smtp")
+                with self._lock:
+                    self._failed += 1
+                    self._finished = time.monotonic()
+                job.future.set_exception(e)
+                return
+
+            delay = self._delay(job.attempts)
+            if isinstance(e, resilience.CircuitOpenError):
+                delay = max(delay, e.retryIn)
+            if kind == "throttle":
+                self.bucket.pause(delay)
+            metrics.retries.inc(service="smtp")
+            with self._lock:
+                self._retries += 1
+            time.sleep(delay)
+            # requeued before this job is marked done, so close() keeps waiting for it
+            self._queue.put(job)
+            return
+
+        with self._lock:
+            self._sent += 1
+            self._finished = time.monotonic()
+        job.future.set_result(None)
+
+    def stats(self) -> DispatchStats:
+        with self._lock:
+            elapsed = (
+                self._finished - self._started if self._started is not None else 0.0
+            )
+            return DispatchStats(self._sent, self._failed, self._retries, elapsed)
+
+    def close(self):
+        """
+        Waits for every queued message, including retries, then stops the workers.
+        """
+
+        self._queue.join()
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for t in self._workers:
+            t.join()
+
+    def __enter__(self) -> "Dispatcher":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
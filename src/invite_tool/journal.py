@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+import time
+
+from invite_tool.mail import emailKey
+
+# row states, in the order a row moves through them
+PLANNED = "planned"
+INVITED = "invited"
+RENDERED = "rendered"
+SENT = "sent"
+STATES = (PLANNED, INVITED, RENDERED, SENT)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    key TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    state TEXT NOT NULL,
+    invite_pk TEXT,
+    expires TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+class JournalRecord:
+    def __init__(
+        self,
+        key: str,
+        username: str,
+        state: str,
+        invitePk: str | None,
+        expires: str | None,
+        error: str | None,
+    ):
+        self.key = key
+        self.username = username
+        self.state = state
+        self.invitePk = invitePk
+        self.expires = expires
+        self.error = error
+
+    def reached(self, state: str) -> bool:
+        return STATES.index(self.state) >= STATES.index(state)
+
+
+def rowKey(email: str, row: int) -> str:
+    """
+    Journal key for a roster row: its email address, so rows are still matched up
+    if the roster is reordered between runs.
+    """
+
+    return emailKey(email) or f"row {row}"
+
+
+class Journal:
+    """
+    SQLite record of where each roster row got to, so a batch that died part-way
+    can pick up where it stopped without creating or emailing anyone twice.
+
+    Updates are buffered and written in one transaction every `batchSize` updates
+    or `interval` seconds, or at once when recorded with flush=True.
+    """
+
+    def __init__(self, path: str, batchSize: int = 50, interval: float = 0.5):
+        self.path = path
+        self.batchSize = batchSize
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+        self._pending: dict[str, tuple] = {}
+        self._lastFlush = time.monotonic()
+
+    def load(self) -> dict[str, JournalRecord]:
+        """
+        Every recorded row, keyed by row key. Read once at the start of a run.
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, username, state, invite_pk, expires, error FROM rows"
+            ).fetchall()
+        return {r[0]: JournalRecord(*r) for r in rows}
+
+    def record(
+        self,
+        key: str,
+        username: str,
+        state: str,
+        invitePk: str | None = None,
+        expires: str | None = None,
+        error: str | None = None,
+        flush: bool = False,
+    ):
+        with self._lock:
+            previous = self._pending.get(key)
+            # keep the invite details from an earlier update still in the buffer
+            if previous is not None:
+                invitePk = invitePk or previous[3]
+                expires = expires or previous[4]
+            self._pending[key] = (
+                key,
+                username,
+                state,
+                invitePk,
+                expires,
+                error,
+                time.time(),
+            )
+
+            due = (
+                len(self._pending) >= self.batchSize
+                or time.monotonic() - self._lastFlush >= self.interval
+            )
+            if flush or due:
+                self._flushLocked()
+
+    def _flushLocked(self):
+        if self._pending:
+            with self._db:
+                self._db.executemany(
+                    """
+                    INSERT INTO rows (key, username, state, invite_pk, expires, error, updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        username = excluded.username,
+                        state = excluded.state,
+                        invite_pk = COALESCE(excluded.invite_pk, rows.invite_pk),
+                        expires = COALESCE(excluded.expires, rows.expires),
+                        error = excluded.error,
+                        updated = excluded.updated
+                    """,
+                    list(self._pending.values()),
+                )
+            self._pending.clear()
+        self._lastFlush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flushLocked()
+
+    def close(self):
+        with self._lock:
+            self._flushLocked()
+            self._db.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,20 +1,116 @@
+import re
+from typing import Any, Iterable, Mapping
+
+# RFC 5322 dot-atom local part and an LDH domain whose last label looks like a
+# TLD. Quoted local parts and address literals are valid but not worth inviting.
+_ATEXT = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+_TLD = r"(?:[A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})"
+_ADDRESS = re.compile(
+    rf"(?P<local>{_ATEXT}+(?:\.{_ATEXT}+)*)@(?P<domain>(?:{_LABEL}\.)+{_TLD}|localhost)"
+)
+
+
+class InvalidEmailError(ValueError):
+    pass
+
+
+class DuplicateEmailError(ValueError):
+    pass
+
+
+def emailKey(address: str) -> str:
+    """
+    Case-folded form of an address for comparing two of them. Assumes the
+    address is valid; for addresses straight from Authentik that is all that's
+    needed.
+    """
+
+    return address.strip().casefold()
+
+
+def normalize(address: str) -> str:
+    """
+    Checks an address and returns it trimmed, with the domain lowercased. Raises
+    InvalidEmailError.
+    """
+
+    address = address.strip()
+    match = _ADDRESS.fullmatch(address)
+    if match is None:
+        raise InvalidEmailError(f"Invalid email address {address!r}.")
+    local, domain = match.group("local", "domain")
+    if len(local) > 64 or len(address) > 254:
+        raise InvalidEmailError(f"Email address {address!r} is too long.")
+    return f"{local}@{domain.lower()}"
+
+
+def normalizeMany(addresses: Iterable[str]) -> list[str | InvalidEmailError]:
+    """
+    Normalizes a whole column of addresses. Invalid ones come back as their
+    InvalidEmailError rather than stopping the rest.
+    """
+
+    results: list[str | InvalidEmailError] = []
+    for address in addresses:
+        try:
+            results.append(normalize(address))
+        except InvalidEmailError as e:
+            results.append(e)
+    return results
+
+
+class AddressIndex:
+    """
+    Normalized addresses seen so far in a roster, for catching duplicates before
+    any invite is made or email sent.
+
+    existing maps emailKey(address) to the username that already has it, e.g.
+    DirectoryIndex.emails.
+    """
+
+    def __init__(self, existing: Mapping[str, str] | None = None):
+        self.existing = existing or {}
+        self.seen: dict[str, Any] = {}
+
+    def add(self, address: str, label: Any = None) -> str:
+        """
+        Normalizes an address and records it under label (e.g. a roster row).
+        Raises InvalidEmailError, or DuplicateEmailError if an earlier label or an
+        existing user has it.
+        """
+
+        addr = normalize(address)
+        key = emailKey(addr)
+
+        username = self.existing.get(key)
+        if username is not None:
+            raise DuplicateEmailError(f"{addr} already belongs to user {username}.")
+        first = self.seen.get(key)
+        if first is not None:
+            raise DuplicateEmailError(f"{addr} is already used by {first}.")
+
+        self.seen[key] = label if label is not None else addr
+        return addr
+
+    def reserve(self, address: str, label: Any = None):
+        """
+        Records an address that is already taken care of, e.g. a row finished in
+        an earlier run, so later rows can't reuse it. Nothing is checked.
+        """
+
+        self.seen.setdefault(emailKey(address), label if label is not None else address)
+
+
 class Email:
     """
     Email object that checks for validity of given email when initalized.
     """
 
     def __init__(self, email: str):
-        a = email.split("@")[0]
-        b = email.split("@")[1]
-        self.prefix = a
-        self.domain = b.split(".")[0]
-        self.tld = b.split(".")[1]
-
-        if self.domain == "localhost":
-            self.addr = f"{self.prefix}@localhost"
-
-        else:
-            self.addr = f"{self.prefix}@{self.domain}.{self.tld}"
+        self.addr = normalize(email)
+        self.prefix, self.domain = self.addr.rsplit("@", 1)
+        self.tld = self.domain.rsplit(".", 1)[-1]
 
     def __str__(self) -> str:
         return self.addr
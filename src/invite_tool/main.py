@@ -2,17 +2,24 @@
 
 import os
 import time
-
-import yaml
-from authentik_client import Flow
-from authentik_client.exceptions import ServiceException
+from typing import TYPE_CHECKING
 
 from pmenu import Menu, Option
 
-from invite_tool import setup
-from invite_tool.authentik import Authentik
+from invite_tool import batch, config, metrics, reconcile, setup, sweep
+from invite_tool.authentik import sharedAuthentik
+from invite_tool.dispatch import Dispatcher
 from invite_tool.invite import InviteEmail
-from invite_tool.user import HomelabUser
+from invite_tool.journal import Journal
+from invite_tool.resilience import CircuitOpenError
+from invite_tool.roster import loadRoster
+from invite_tool.smtp import SMTPPool
+from invite_tool.spool import SpoolDeliverer, spoolFromConf
+from invite_tool.twingate import Twingate, TwingateError
+from invite_tool.user import HomelabUser, validateUser
+
+if TYPE_CHECKING:
+    from authentik_client import Flow
 
 # global nt, headerText
 
@@ -30,13 +37,6 @@ headerText = """
 """
 
 
-with open("./conf/conf.yml", "r") as confFile:
-    conf: dict = yaml.safe_load(confFile)
-
-
-authObj = Authentik(conf["authentik"])
-
-
 def header():
     """
     Prints header text. Only used by CLI.
@@ -52,8 +52,11 @@ def create_invite() -> None:
     """
     Interactive invitation helper tool. Used by CLI.
     """
+    conf = config.loadConf()
+    authObj = sharedAuthentik()
+
     knownGroups = authObj.fetchGroupList()
-    knownInviteFlows: list[Flow] = authObj.fetchInviteFlows()
+    knownInviteFlows: list["Flow"] = authObj.fetchInviteFlows()
 
     print("\n ** New invite ** \n")
 
@@ -78,10 +81,9 @@ def create_invite() -> None:
 
     groupsToAdd = input(
         "Enter valid group name(s) separated by a space on the following line. Entering nothing will result in the user having broken permissions.\n : "
-    ).split(" ")
+    ).split()
 
     newUser = HomelabUser(
-        authObj,
         first,
         last,
         email,
@@ -91,6 +93,7 @@ def create_invite() -> None:
         phone=phone,
         username=username,
     )
+    validateUser(newUser, authObj)
 
     print("\nConfirm the following information:")
     print(newUser.preview())
@@ -104,7 +107,32 @@ def create_invite() -> None:
     print(f"Created HomelabUser object for {newUser.username}.")
 
     if not authObj.inviteExists(newUser):
-        inviteObj = authObj.createInvite(newUser, knownInviteFlows[flowChoice])
+        import threading
+
+        # Twingate is set up while the invite is made; it reports on its own
+        twingate = Twingate.fromConf(conf.get("twingate"))
+        twingateJob: threading.Thread | None = None
+        outcomes: list[str | TwingateError] = []
+        if twingate is not None and twingate.wants(newUser):
+            twingateJob = threading.Thread(
+                target=lambda: outcomes.extend(twingate.createUsers([newUser]))
+            )
+            twingateJob.start()
+
+        try:
+            inviteObj = authObj.createInvite(newUser, knownInviteFlows[flowChoice])
+        finally:
+            if twingateJob is not None:
+                twingateJob.join()
+                outcome = outcomes[0] if outcomes else TwingateError("No reply.")
+                if isinstance(outcome, Exception):
+                    print(
+                        f"ERROR: Could not add {newUser.username} to Twingate: {outcome}"
+                    )
+                else:
+                    print(
+                        f"Added {newUser.username} to Twingate; Twingate sends its own invite."
+                    )
         print(f"Created invitation in Authentik for {newUser.username}.")
 
         inviteEmail = InviteEmail(
@@ -118,8 +146,19 @@ def create_invite() -> None:
             f"Created invite email for {newUser.username}. Will be sent from {conf['fromAddr']} to {newUser.email}."
         )
 
-        inviteEmail.send(mailtrapApiKey=conf["mailtrap"]["key"])
-        print(f"Sent invite email to {newUser.email}.")
+        spool = spoolFromConf(conf["mailtrap"])
+        if spool is not None:
+            spool.put(inviteEmail.message)
+            inviteEmail.remind()
+            print(
+                f"Queued invite email to {newUser.email} in {spool.path}; --deliver sends it."
+            )
+        else:
+            with SMTPPool.fromConf(conf["mailtrap"]) as transport:
+                inviteEmail.send(
+                    mailtrapApiKey=conf["mailtrap"]["key"], transport=transport
+                )
+            print(f"Sent invite email to {newUser.email}.")
 
         print(f"Invitation success! Invite expires on {str(inviteObj.expires)}.")
         print(f"Invite token: {inviteObj.pk}")
@@ -131,6 +170,117 @@ def create_invite() -> None:
         return
 
 
+# CLI bulk invitation
+def bulk_invite(rosterPath: str, journalPath: str | None = None) -> bool:
+    """
+    Non-interactive invitation of every person in a roster file. Used by CLI.
+
+    With a journal, rerunning an interrupted roster carries on where it stopped.
+
+    Returns True if every row succeeded.
+    """
+    conf = config.loadConf()
+    authObj = sharedAuthentik()
+
+    entries = loadRoster(rosterPath)
+    print(f"Loaded {len(entries)} people from {rosterPath}.")
+
+    spool = spoolFromConf(conf["mailtrap"])
+    if journalPath:
+        with Journal(journalPath) as journal:
+            results = batch.runBatch(
+                authObj, conf, entries, journal=journal, spool=spool
+            )
+    else:
+        results = batch.runBatch(authObj, conf, entries, spool=spool)
+    print(batch.summary(results))
+
+    return all(r.ok for r in results)
+
+
+# CLI desired-state sync
+def reconcile_roster(
+    rosterPath: str, dryRun: bool = False, revoke: bool = True
+) -> bool:
+    """
+    Brings Authentik in line with a roster of everyone who should have access:
+    invites who is missing and revokes invites for who is gone. Used by CLI.
+
+    Returns True if every change was made.
+    """
+    conf = config.loadConf()
+    authObj = sharedAuthentik()
+
+    entries = loadRoster(rosterPath)
+    directory = batch.DirectorySnapshot(authObj)
+    changes = reconcile.plan(directory, entries, revoke)
+    print(changes)
+
+    if dryRun or changes.empty:
+        return not changes.invalid
+
+    maxConcurrency = int(authObj.authConf.get("maxConcurrency") or 8)
+    applied = reconcile.apply(
+        authObj, conf, changes, maxConcurrency, spool=spoolFromConf(conf["mailtrap"])
+    )
+    print(applied)
+
+    return applied.ok and not changes.invalid
+
+
+# CLI spooled email delivery
+def deliver_spool(watch: bool = False) -> bool:
+    """
+    Sends the emails waiting in the spool, then exits, or with watch keeps
+    sending new ones until interrupted. Used by CLI.
+
+    Returns True if nothing failed.
+    """
+    import signal
+    import threading
+
+    conf = config.loadConf()
+    spool = spoolFromConf(conf["mailtrap"])
+    if spool is None:
+        print("No spool configured; set mailtrap.spool in conf.yml.")
+        return False
+
+    recovered = spool.recover()
+    if recovered:
+        print(f"Requeued {recovered} emails left mid-delivery by an earlier run.")
+
+    with SMTPPool.fromConf(conf["mailtrap"]) as transport:
+        with Dispatcher.fromConf(conf["mailtrap"], transport) as dispatcher:
+            deliverer = SpoolDeliverer(spool, dispatcher)
+            if watch:
+                stop = threading.Event()
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    signal.signal(sig, lambda *args: stop.set())
+                print(f"Delivering from {spool.path} until stopped.")
+                deliverer.run(stop)
+            else:
+                deliverer.drain()
+
+    print(f"{deliverer.sent} sent, {deliverer.failed} failed. Spool: {spool.counts()}")
+    return deliverer.failed == 0
+
+
+# CLI invite cleanup
+def sweep_invites(olderThan: float | None = None, dryRun: bool = False) -> bool:
+    """
+    Deletes expired invites, or those older than a number of days. Used by CLI.
+
+    Returns True if every selected invite was deleted.
+    """
+    authObj = sharedAuthentik()
+    maxConcurrency = int(authObj.authConf.get("maxConcurrency") or 8)
+
+    results = sweep.sweepInvites(authObj, olderThan, dryRun, maxConcurrency)
+    print(sweep.summary(results, dryRun))
+
+    return all(r.deleted or dryRun for r in results)
+
+
 def initial_setup():
     if setup.getExisting() != setup.confDefault:
         clearExisting = input(
@@ -173,28 +323,132 @@ def prompt_menu() -> None:
 # 	print(m.addr)  # merp
 
 
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Create invites for Authentik and (if configured) Twingate."
+    )
+    parser.add_argument(
+        "--roster",
+        help="Invite everyone in a CSV or YAML roster file without prompting.",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Record roster progress in this SQLite file, and resume from it if the "
+        "run was interrupted.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run the invite service over HTTP until stopped (see the service "
+        "section of conf.yml).",
+    )
+    parser.add_argument(
+        "--reconcile",
+        metavar="ROSTER",
+        help="Invite everyone in ROSTER who has no account or invite yet, and revoke "
+        "this tool's invites for anyone not in it.",
+    )
+    parser.add_argument(
+        "--keep-invites",
+        action="store_true",
+        help="With --reconcile, don't revoke invites for people missing from the roster.",
+    )
+    parser.add_argument(
+        "--deliver",
+        action="store_true",
+        help="Send the emails waiting in the spool (mailtrap.spool in conf.yml) and exit.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="With --deliver, keep sending newly spooled emails until stopped.",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Delete expired invites (or, with --older-than, old ones) and exit.",
+    )
+    parser.add_argument(
+        "--older-than",
+        type=float,
+        metavar="DAYS",
+        help="With --sweep, also delete unexpired invites created more than DAYS days ago.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --sweep or --reconcile, show what would change without changing it.",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write timing metrics and counters here when done (.prom for Prometheus "
+        "text, otherwise JSON).",
+    )
+
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    from authentik_client.exceptions import ServiceException
+
     # _test()
+    args = cli()
+    if args.serve:
+        from invite_tool import service
+
+        conf = config.loadConf()
+        serviceConf = conf.get("service") or {}
+        service.serve(
+            conf,
+            port=int(serviceConf.get("port") or 8080),
+            host=serviceConf.get("host") or "127.0.0.1",
+        )
+        exit(0)
+
+    if args.deliver:
+        ok = deliver_spool(args.watch)
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+        exit(0 if ok else 1)
+
+    if args.reconcile:
+        ok = reconcile_roster(args.reconcile, args.dry_run, not args.keep_invites)
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+        exit(0 if ok else 1)
+
+    if args.sweep:
+        ok = sweep_invites(args.older_than, args.dry_run)
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+        exit(0 if ok else 1)
+
+    if args.roster:
+        ok = bulk_invite(args.roster, args.journal)
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+        exit(0 if ok else 1)
+
     header()
 
-    badGatewayCount = 0
+    # each request already retries with backoff, so a failure that reaches here is
+    # reported and the menu shown again rather than replaying the whole action
+    failureCount = 0
     while True:
         try:
             prompt_menu()
-        except ServiceException as e:
-            if int(e.status) == 502:  # type:ignore
-                if badGatewayCount <= 3:
-                    badGatewayCount += 1
-                    print(
-                        f"Got a bad gateway error when trying to connect to {authObj.conf.host}. Waiting 15 seconds before re-trying."
-                    )
-                    time.sleep(15)
-                    pass
-                else:
-                    print(
-                        f"Got a bad gateway error when trying to connect to {authObj.conf.host}. Too many retries attempted. Exiting..."
-                    )
-                    exit(1)
-
+            failureCount = 0
+        except (ServiceException, CircuitOpenError) as e:
+            failureCount += 1
+            if failureCount <= 3:
+                print(
+                    f"Could not reach {sharedAuthentik().host} ({e}). Nothing further "
+                    "was done; returning to the menu."
+                )
             else:
-                raise e
+                print(
+                    f"Could not reach {sharedAuthentik().host}. Too many failures. Exiting..."
+                )
+                exit(1)
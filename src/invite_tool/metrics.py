@@ -0,0 +1,194 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from typing import Iterator
+
+# upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _key(labels: dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _promLabels(key: LabelKey, extra: dict[str, str] | None = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(_key(labels), 0)
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [{"labels": dict(k), "value": v} for k, v in self._values.items()]
+
+    def prometheus(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_promLabels(key)} {value}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series: dict[LabelKey, _Series] = {}
+
+    def observe(self, seconds: float, **labels: str):
+        key = _key(labels)
+        slot = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.counts[slot] += 1
+            series.count += 1
+            series.sum += seconds
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "labels": dict(key),
+                    "count": s.count,
+                    "sum": round(s.sum, 6),
+                    "mean": round(s.sum / s.count, 6) if s.count else 0,
+                    "buckets": {
+                        str(b): c for b, c in zip(BUCKETS + ("+Inf",), s.counts)
+                    },
+                }
+                for key, s in self._series.items()
+            ]
+
+    def prometheus(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, s in self._series.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), s.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket{_promLabels(key, {'le': str(bound)})} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_promLabels(key)} {s.sum}")
+                lines.append(f"{self.name}_count{_promLabels(key)} {s.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help)
+            assert isinstance(metric, Counter)
+            return metric
+
+    def histogram(self, name: str, help: str = "") -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help)
+            assert isinstance(metric, Histogram)
+            return metric
+
+    def toDict(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+    def toJSON(self) -> str:
+        return json.dumps(self.toDict(), indent=2)
+
+    def toPrometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """
+        Writes every metric to a file: Prometheus text if it ends in .prom or .txt,
+        JSON otherwise.
+        """
+
+        text = (
+            self.toPrometheus() if path.endswith((".prom", ".txt")) else self.toJSON()
+        )
+        with open(path, "w") as f:
+            f.write(text)
+
+
+registry = Registry()
+
+authentikLatency = registry.histogram(
+    "invite_tool_authentik_request_seconds",
+    "Authentik API request latency by endpoint.",
+)
+smtpLatency = registry.histogram(
+    "invite_tool_smtp_phase_seconds",
+    "SMTP latency by phase (connect, tls, auth, data).",
+)
+twingateLatency = registry.histogram(
+    "invite_tool_twingate_request_seconds", "Twingate API request latency."
+)
+invitesCreated = registry.counter(
+    "invite_tool_invites_created_total", "Invites created in Authentik."
+)
+emailsSent = registry.counter(
+    "invite_tool_emails_sent_total", "Invite emails accepted by the SMTP server."
+)
+twingateUsersCreated = registry.counter(
+    "invite_tool_twingate_users_created_total", "Users added to the Twingate network."
+)
+retries = registry.counter("invite_tool_retries_total", "Calls retried, by service.")
+failures = registry.counter(
+    "invite_tool_failures_total", "Calls that failed for good, by service."
+)
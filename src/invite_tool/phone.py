@@ -1,5 +1,11 @@
+import functools
+import threading
+from typing import Iterable
+
 import yaml
 
+from invite_tool import config
+
 
 class PhoneFormat:
     """
@@ -7,67 +13,158 @@ class PhoneFormat:
     """
 
     def __init__(self, formatDict: dict):
-        self.countryCode: str = formatDict["code"]
+        self.countryCode: str = str(formatDict["code"])
         self.usedBy: list[str] = formatDict["countries"]
         self.length: int = formatDict["length"]
         self.grouping: list[int] = formatDict["grouping"]
         self.divider: str = formatDict["divider"]
 
+        # (start, end) slices of the national number for each group, worked out once
+        self.spans: list[tuple[int, int]] = []
+        start = 0
+        for size in self.grouping:
+            self.spans.append((start, start + size))
+            start += size
 
-class Phone:
+    def apply(self, digits: str) -> str:
+        """
+        Formats a national number (no country code) that is already known to have
+        the right length.
+        """
+
+        grouped = self.divider.join(digits[a:b] for a, b in self.spans)
+        return self.countryCode + " " + grouped
+
+
+class _TrieNode:
+    __slots__ = ("children", "format")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.format: PhoneFormat | None = None
+
+
+def _digits(phoneNumber: str) -> str:
+    return "".join(c for c in phoneNumber if c.isdigit())
+
+
+class FormatRegistry:
     """
-    Phone object containing an unformatted phone number, the phone number region's format, and its "pretty" (formatted) representation
+    Every phone format, indexed as a digit trie on the country code so the longest
+    matching code wins. Formatted results are memoized.
     """
 
-    def __init__(self, phoneNumber: str):
-        with open("./conf/phone.yml", "r") as f1:
-            # explicit typing for type hints, because pyyaml can't do that automatically
-            self.phone_formats: list[dict[str, str | list[int | str]]] = yaml.safe_load(
-                f1
+    def __init__(self, formats: Iterable[dict], cacheSize: int = 4096):
+        self._root = _TrieNode()
+        for f in formats:
+            self._insert(PhoneFormat(f))
+
+        self.format = functools.lru_cache(maxsize=cacheSize)(self._format)
+
+    @classmethod
+    def fromFile(cls, path: str | None = None) -> "FormatRegistry":
+        with open(path or config.sharedPath("phone.yml"), "r") as f:
+            return cls(yaml.safe_load(f) or [])
+
+    def _insert(self, fmt: PhoneFormat):
+        node = self._root
+        for digit in fmt.countryCode:
+            node = node.children.setdefault(digit, _TrieNode())
+        node.format = fmt
+
+    def match(self, digits: str) -> PhoneFormat | None:
+        """
+        Finds the format with the longest country code that prefixes the digits.
+        """
+
+        node = self._root
+        found = None
+        for digit in digits:
+            child = node.children.get(digit)
+            if child is None:
+                break
+            node = child
+            if node.format is not None:
+                found = node.format
+        return found
+
+    def _format(self, phoneNumber: str) -> str:
+        digits = _digits(phoneNumber)
+        regionFormat = self.match(digits)
+        if regionFormat is None:
+            raise ValueError(
+                f"No phone format matches the country code of {phoneNumber}."
             )
 
-        self.unformatted = phoneNumber
-        self.regionFormat = self._findRegionFormat()
-        self.pretty = self._formatPretty()
+        national = digits[len(regionFormat.countryCode) :]
+        if len(national) != regionFormat.length:
+            raise ValueError(
+                f"{phoneNumber} should have {regionFormat.length} digits after "
+                f"country code {regionFormat.countryCode}, not {len(national)}."
+            )
 
-    def __str__(self) -> str:
-        return self.pretty
+        return regionFormat.apply(national)
 
-    def _findRegionFormat(self) -> PhoneFormat:
-        matched = {}
+    def formatMany(self, phoneNumbers: Iterable[str]) -> list[str | ValueError]:
+        """
+        Formats a whole column of phone numbers. Empty entries stay empty, and
+        repeated numbers are only formatted once. A number that can't be formatted
+        comes back as the ValueError saying why; one bad number does not stop the
+        rest.
+        """
 
-        for f in self.phone_formats:
-            if f["code"] == self.unformatted[: len(f["code"])]:
-                matched = f
+        formatted: list[str | ValueError] = []
+        for p in phoneNumbers:
+            try:
+                formatted.append(self.format(p) if p else "")
+            except ValueError as e:
+                formatted.append(e)
+        return formatted
 
-        return PhoneFormat(matched)
 
-    def _formatPretty(self) -> str:
-        noCountryCode = self.unformatted[len(self.regionFormat.countryCode) :]
-        noDashes = []
-        formatted = []
+_registry: FormatRegistry | None = None
+_registryLock = threading.Lock()
 
-        for char in noCountryCode:
-            if char == "-" or char == " ":
-                continue
-            else:
-                noDashes.append(char)
 
-        noDashes = "".join(noDashes)
+def formatRegistry() -> FormatRegistry:
+    """
+    The shared registry, loaded from conf/phone.yml the first time it is needed.
+    """
+
+    global _registry
+    if _registry is None:
+        with _registryLock:
+            if _registry is None:
+                _registry = FormatRegistry.fromFile()
+    return _registry
 
-        if len(noDashes) != self.regionFormat.length:
-            print(f"Incorrect length for found country {self.regionFormat.countryCode}")
-            return self.unformatted
 
-        group = 0
-        lenWithGroups = self.regionFormat.grouping[0]
+def format_many(phoneNumbers: Iterable[str]) -> list[str | ValueError]:
+    return formatRegistry().formatMany(phoneNumbers)
 
-        for i in range(self.regionFormat.length):
-            if i == lenWithGroups:
-                formatted.append(self.regionFormat.divider)
-                group += 1
-                lenWithGroups += self.regionFormat.grouping[group]
 
-            formatted.append(noDashes[i])
+class Phone:
+    """
+    Phone object containing an unformatted phone number, the phone number region's format, and its "pretty" (formatted) representation
+    """
+
+    def __init__(self, phoneNumber: str, registry: FormatRegistry | None = None):
+        self.registry = registry or formatRegistry()
 
-        return self.regionFormat.countryCode + " " + "".join(formatted)
+        self.unformatted = phoneNumber
+        self.regionFormat = self._findRegionFormat()
+        self.pretty = self._formatPretty()
+
+    def __str__(self) -> str:
+        return self.pretty
+
+    def _findRegionFormat(self) -> PhoneFormat:
+        regionFormat = self.registry.match(_digits(self.unformatted))
+        if regionFormat is None:
+            raise ValueError(
+                f"No phone format matches the country code of {self.unformatted}."
+            )
+        return regionFormat
+
+    def _formatPretty(self) -> str:
+        return self.registry.format(self.unformatted)
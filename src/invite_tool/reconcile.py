@@ -0,0 +1,198 @@
+import asyncio
+import copy
+from typing import TYPE_CHECKING
+
+from invite_tool import batch
+from invite_tool.aioauthentik import AsyncAuthentik
+from invite_tool.authentik import Authentik
+from invite_tool.directory import INVITE_SUFFIX
+from invite_tool.mail import InvalidEmailError, emailKey, normalize
+from invite_tool.roster import RosterEntry
+from invite_tool.spool import Spool
+from invite_tool.user import usernameFormat
+from invite_tool.username import resolveUsernames
+
+if TYPE_CHECKING:
+    from authentik_client.models.invitation import Invitation
+
+
+def _inviteEmail(invite: "Invitation") -> str:
+    fixedData = getattr(invite, "fixed_data", None) or {}
+    return emailKey(str(fixedData.get("email") or ""))
+
+
+class Plan:
+    """
+    Difference between a desired-state roster and one directory snapshot.
+
+    People are matched to users and invites by email address, so someone whose
+    generated username would now be numbered is still recognized.
+        create: entries that need an invite, with their username settled
+        pending: entries that already have an invite
+        existing: entries that already have an account, with its username
+        invalid: entries that can't be invited, with the reason
+        revoke: invites made by this tool for people no longer in the roster
+
+    Expired invites still count as pending; sweep them first to have them replaced.
+    """
+
+    def __init__(self):
+        self.create: list[RosterEntry] = []
+        self.pending: list[tuple[RosterEntry, "Invitation"]] = []
+        self.existing: list[tuple[RosterEntry, str]] = []
+        self.invalid: list[tuple[RosterEntry, str]] = []
+        self.revoke: list["Invitation"] = []
+
+    @property
+    def empty(self) -> bool:
+        return not self.create and not self.revoke
+
+    def __str__(self) -> str:
+        lines = []
+        for entry in self.create:
+            lines.append(f"+ invite {entry.username} <{entry.email}>")
+        for invite in self.revoke:
+            lines.append(f"- revoke {invite.name} <{_inviteEmail(invite)}>")
+        for entry, reason in self.invalid:
+            lines.append(f"! row {entry.row} <{entry.email}>: {reason}")
+        lines.append(
+            f"\n{len(self.create)} to invite, {len(self.revoke)} to revoke, "
+            f"{len(self.pending)} already invited, {len(self.existing)} already users, "
+            f"{len(self.invalid)} invalid."
+        )
+        return "\n".join(lines)
+
+
+def plan(
+    directory: batch.DirectorySnapshot, entries: list[RosterEntry], revoke: bool = True
+) -> Plan:
+    """
+    Works out the change set locally, from a snapshot taken once; nothing here
+    touches the network, so it costs the same per row whatever the directory size.
+    """
+
+    index = directory.index
+    # an address can have more than one invite, e.g. under different usernames
+    invitesByEmail: dict[str, list["Invitation"]] = {}
+    for invite in index.invites.values():
+        invitesByEmail.setdefault(_inviteEmail(invite), []).append(invite)
+    invitesByEmail.pop("", None)
+
+    result = Plan()
+    wanted: set[str] = set()
+    toCreate: list[RosterEntry] = []
+    for entry in entries:
+        missing = entry.missing()
+        if missing:
+            result.invalid.append((entry, f"No {', '.join(missing)} given."))
+            continue
+        try:
+            email = emailKey(normalize(entry.email))
+        except InvalidEmailError as e:
+            result.invalid.append((entry, str(e)))
+            continue
+        if email in wanted:
+            result.invalid.append(
+                (entry, "Email address appears more than once in the roster.")
+            )
+            continue
+        wanted.add(email)
+
+        if email in index.emails:
+            result.existing.append((entry, index.emails[email]))
+        elif email in invitesByEmail:
+            result.pending.append((entry, invitesByEmail[email][0]))
+        else:
+            try:
+                directory.findFlow(entry.flow)
+            except ValueError as e:
+                result.invalid.append((entry, str(e)))
+                continue
+            toCreate.append(entry)
+
+    usernames = resolveUsernames(toCreate, usernameFormat(), index.usernameTaken)
+    for entry, username in zip(toCreate, usernames):
+        if not username:
+            result.invalid.append((entry, "No username can be made from this name."))
+            continue
+        entry = copy.copy(entry)
+        entry.username = username
+        result.create.append(entry)
+
+    if revoke:
+        # invites made by hand are left alone
+        result.revoke = [
+            invite
+            for email, invites in invitesByEmail.items()
+            if email not in wanted
+            for invite in invites
+            if (invite.name or "").endswith(INVITE_SUFFIX)
+        ]
+    return result
+
+
+class ApplyResult:
+    def __init__(
+        self,
+        invites: list[batch.RowResult],
+        revoked: list[tuple["Invitation", BaseException | None]],
+    ):
+        self.invites = invites
+        self.revoked = revoked
+
+    @property
+    def ok(self) -> bool:
+        return all(r.ok for r in self.invites) and all(
+            e is None for _, e in self.revoked
+        )
+
+    def __str__(self) -> str:
+        lines = [str(r) for r in self.invites]
+        for invite, error in self.revoked:
+            lines.append(
+                f"{invite.name} FAILED to revoke: {error}"
+                if error
+                else f"{invite.name} revoked"
+            )
+        invited = sum(1 for r in self.invites if r.ok)
+        revoked = sum(1 for _, e in self.revoked if e is None)
+        lines.append(
+            f"\n{invited} of {len(self.invites)} invited, {revoked} of {len(self.revoked)} revoked."
+        )
+        return "\n".join(lines)
+
+
+def apply(
+    authObj: Authentik,
+    conf: dict,
+    changes: Plan,
+    maxConcurrency: int = 8,
+    spool: Spool | None = None,
+) -> ApplyResult:
+    """
+    Makes only the changes in a plan: invites through the batch pipeline, and
+    revocations concurrently, at most maxConcurrency at a time.
+    """
+
+    # invites first, while the snapshot the plan came from is still cached;
+    # revoking drops it
+    invites = (
+        batch.runBatch(authObj, conf, changes.create, spool=spool)
+        if changes.create
+        else []
+    )
+
+    revoked: list[tuple["Invitation", BaseException | None]] = []
+    if changes.revoke:
+
+        async def revokeAll() -> list:
+            async with AsyncAuthentik(authObj, maxConcurrency) as aioAuth:
+                return await aioAuth.deleteInvites(str(i.pk) for i in changes.revoke)
+
+        outcomes = asyncio.run(revokeAll())
+        revoked = [
+            (invite, outcome if isinstance(outcome, BaseException) else None)
+            for invite, outcome in zip(changes.revoke, outcomes)
+        ]
+
+    return ApplyResult(invites, revoked)
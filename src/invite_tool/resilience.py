@@ -0,0 +1,192 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Any, Callable
+
+from invite_tool import metrics
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a service that has been failing, until its breaker
+    lets a trial call through again.
+    """
+
+    def __init__(self, name: str, retryIn: float):
+        super().__init__(
+            f"{name} is unavailable; not retrying for another {retryIn:.0f}s."
+        )
+        self.name = name
+        self.retryIn = retryIn
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures, failing every call fast for
+    `resetTimeout` seconds. After that a single trial call is let through
+    (half-open): success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name: str, threshold: int = 5, resetTimeout: float = 30):
+        self.name = name
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._openedAt: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._openedAt is None:
+                return "closed"
+            if time.monotonic() - self._openedAt >= self.resetTimeout:
+                return "half-open"
+            return "open"
+
+    def before(self):
+        """
+        Raises CircuitOpenError if calls are not allowed right now.
+        """
+
+        with self._lock:
+            if self._openedAt is None:
+                return
+
+            waited = time.monotonic() - self._openedAt
+            if waited < self.resetTimeout:
+                raise CircuitOpenError(self.name, self.resetTimeout - waited)
+            if self._trial:
+                # someone else is already making the trial call
+                raise CircuitOpenError(self.name, 0)
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._openedAt = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._openedAt = time.monotonic()
+            self._trial = False
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    `retryable` decides which exceptions are worth another attempt, and
+    `retryAfter` may pull a server-requested delay (e.g. a Retry-After header)
+    out of one; that delay is used instead of the computed backoff.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 4,
+        base: float = 0.5,
+        maxDelay: float = 30,
+        retryable: Callable[[BaseException], bool] = lambda e: False,
+        retryAfter: Callable[[BaseException], float | None] = lambda e: None,
+    ):
+        self.attempts = attempts
+        self.base = base
+        self.maxDelay = maxDelay
+        self.retryable = retryable
+        self.retryAfter = retryAfter
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        requested = self.retryAfter(error)
+        if requested is not None:
+            return min(self.maxDelay, max(0.0, requested))
+        return random.uniform(0, min(self.maxDelay, self.base * 2 ** (attempt - 1)))
+
+
+def call(
+    func: Callable[..., Any],
+    *args,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | None = None,
+    beforeRetry: Callable[[BaseException], Any] | None = None,
+    **kwargs,
+) -> Any:
+    """
+    Calls func under a retry policy and, optionally, a circuit breaker.
+
+    beforeRetry runs before every retry and may return a non-None value to finish
+    early with that value, e.g. when it finds the first attempt actually went
+    through.
+    """
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            retryable = policy.retryable(e)
+            if breaker is not None:
+                # only failures of the service count towards opening the breaker
+                if retryable:
+                    breaker.failure()
+                else:
+                    breaker.success()
+            service = breaker.name if breaker is not None else "unknown"
+            if not retryable or attempt >= policy.attempts:
+                metrics.failures.inc(service=service)
+                raise
+
+            metrics.retries.inc(service=service)
+            time.sleep(policy.delay(attempt, e))
+            if beforeRetry is not None:
+                found = beforeRetry(e)
+                if found is not None:
+                    return found
+            continue
+
+        if breaker is not None:
+            breaker.success()
+        return result
+
+
+def parseRetryAfter(value: str | None) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, given either as seconds or as an
+    HTTP date.
+    """
+
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakersLock = threading.Lock()
+
+
+def breaker(name: str, threshold: int = 5, resetTimeout: float = 30) -> CircuitBreaker:
+    """
+    The process-wide breaker for a service, shared by everything that talks to it.
+    """
+
+    with _breakersLock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, threshold, resetTimeout)
+        return _breakers[name]
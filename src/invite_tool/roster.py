@@ -0,0 +1,132 @@
+import csv
+import os
+
+import yaml
+
+# header names accepted for each required column, compared case-insensitively
+REQUIRED = {
+    "first name": ("first", "firstname"),
+    "last name": ("last", "lastname"),
+    "email": ("email",),
+}
+
+
+class RosterEntry:
+    """
+    One row of a roster file, as read from disk. Nothing is validated here; that
+    happens when the row is turned into a HomelabUser.
+    """
+
+    def __init__(
+        self,
+        row: int,
+        first: str,
+        last: str,
+        email: str,
+        groups: list[str],
+        flow: str = "",
+        middleName: str = "",
+        middleInitial: str = "",
+        phone: str = "",
+        username: str = "",
+    ):
+        self.row = row
+        self.first = first
+        self.last = last
+        self.email = email
+        self.groups = groups
+        self.flow = flow
+        self.middleName = middleName
+        self.middleInitial = middleInitial
+        self.phone = phone
+        self.username = username
+
+    def missing(self) -> list[str]:
+        """
+        Required fields left blank, e.g. ["first name", "email"].
+        """
+
+        values = {"first name": self.first, "last name": self.last, "email": self.email}
+        return [name for name, value in values.items() if not value]
+
+    def __repr__(self) -> str:
+        return (
+            f"RosterEntry(row={self.row}, first={self.first}, last={self.last}, "
+            f"email={self.email})"
+        )
+
+
+def _splitGroups(raw) -> list[str]:
+    if raw is None:
+        return []
+    if isinstance(raw, list):
+        return [str(g) for g in raw if str(g) != ""]
+    # CSV cells hold groups separated by spaces, same as the interactive prompt
+    return [g for g in str(raw).replace(",", " ").split(" ") if g != ""]
+
+
+def _entryFromDict(row: int, data: dict) -> RosterEntry:
+    # headers match whatever their case, so "First" and "EMAIL" work too
+    data = {str(k).strip().casefold(): v for k, v in data.items() if k is not None}
+
+    def get(*keys) -> str:
+        for key in keys:
+            value = data.get(key)
+            if value is not None:
+                return str(value).strip()
+        return ""
+
+    return RosterEntry(
+        row=row,
+        first=get(*REQUIRED["first name"]),
+        last=get(*REQUIRED["last name"]),
+        email=get(*REQUIRED["email"]),
+        groups=_splitGroups(data.get("groups")),
+        flow=get("flow"),
+        middleName=get("middle", "middlename"),
+        middleInitial=get("middleinitial", "middle_initial"),
+        phone=get("phone"),
+        username=get("username"),
+    )
+
+
+def loadRoster(path: str) -> list[RosterEntry]:
+    """
+    Reads a roster from a CSV or YAML file.
+
+    CSV files need a header row. YAML files hold a list of mappings. Both use the
+    keys first, middle, last, email, phone, groups, and flow, in any case;
+    middleInitial and username are optional. A CSV file without a first, last, or
+    email column is rejected outright.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in (".yml", ".yaml"):
+        with open(path, "r") as f:
+            rows = yaml.safe_load(f) or []
+        if not isinstance(rows, list):
+            raise ValueError(f"Roster {path} must contain a list of people.")
+
+    elif ext == ".csv":
+        with open(path, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+        headers = {str(h).strip().casefold() for h in reader.fieldnames or []}
+        absent = [name for name, keys in REQUIRED.items() if headers.isdisjoint(keys)]
+        if absent:
+            raise ValueError(f"Roster {path} has no {', '.join(absent)} column.")
+
+    else:
+        raise ValueError(f"Unsupported roster format {ext}. Use .csv or .yml.")
+
+    return entriesFromRows(rows)
+
+
+def entriesFromRows(rows: list[dict]) -> list[RosterEntry]:
+    """
+    Roster entries from rows that are already parsed, e.g. a JSON request body.
+    """
+
+    # row numbers start at 1 so they line up with what a person sees in the file
+    return [_entryFromDict(i + 1, r) for i, r in enumerate(rows)]
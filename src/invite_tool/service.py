@@ -0,0 +1,242 @@
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from invite_tool import batch, metrics
+from invite_tool.authentik import Authentik, sharedAuthentik
+from invite_tool.dispatch import Dispatcher
+from invite_tool.roster import entriesFromRows
+from invite_tool.smtp import SMTPPool
+from invite_tool.spool import SpoolDeliverer, spoolFromConf
+from invite_tool.templates import inviteTemplates
+from invite_tool.user import usernameFormat
+
+
+class ServiceClosing(Exception):
+    pass
+
+
+class InviteService:
+    """
+    Everything a request needs, built once and kept warm: the Authentik client and
+    its caches, the SMTP pool, and a Dispatcher shared by every request.
+
+    Concurrent requests that need the directory share one fetch through the
+    Authentik cache, and invites created here are added to the cached index
+    rather than forcing a refetch.
+
+    If a spool is configured, requests only queue their emails there and a
+    background deliverer sends them, picking up anything left from a previous run.
+    """
+
+    def __init__(
+        self, conf: dict, authObj: Authentik | None = None, createWorkers: int = 4
+    ):
+        self.conf = conf
+        self.authObj = authObj or sharedAuthentik()
+        self.createWorkers = createWorkers
+        self.transport = SMTPPool.fromConf(conf["mailtrap"])
+        self.dispatcher = Dispatcher.fromConf(conf["mailtrap"], self.transport)
+        self.claims = batch.UsernameClaims()
+
+        self.spool = spoolFromConf(conf["mailtrap"])
+        self._stopDelivery = threading.Event()
+        self._delivery: threading.Thread | None = None
+        if self.spool is not None:
+            self.spool.recover()
+            deliverer = SpoolDeliverer(self.spool, self.dispatcher)
+            self._delivery = threading.Thread(
+                target=deliverer.run, args=(self._stopDelivery, 1), name="spool"
+            )
+            self._delivery.start()
+
+        self._lock = threading.Lock()
+        self._inFlight = 0
+        self._closing = False
+
+    def warm(self):
+        """
+        Loads templates and formats and fetches the directory before the first
+        request needs them.
+        """
+
+        inviteTemplates()
+        usernameFormat()
+        self.authObj.fetchDirectoryIndex()
+        self.authObj.fetchInviteFlows()
+
+    def invite(self, rows: list[dict]) -> list[batch.RowResult]:
+        with self._lock:
+            if self._closing:
+                raise ServiceClosing("Shutting down; not accepting new invites.")
+            self._inFlight += 1
+
+        try:
+            entries = entriesFromRows(rows)
+            return batch.runBatch(
+                self.authObj,
+                self.conf,
+                entries,
+                createWorkers=self.createWorkers,
+                dispatcher=self.dispatcher,
+                claims=self.claims,
+                spool=self.spool,
+            )
+        finally:
+            with self._lock:
+                self._inFlight -= 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "status": "draining" if self._closing else "ok",
+                "inFlight": self._inFlight,
+                "delivery": str(self.dispatcher.stats()),
+                "cache": {
+                    "hits": self.authObj.cache.hits,
+                    "misses": self.authObj.cache.misses,
+                },
+                "connections": self.authObj.poolStats(),
+            }
+
+    def close(self):
+        """
+        Refuses new invites, then waits for every queued email to be sent.
+        """
+
+        with self._lock:
+            self._closing = True
+        if self._delivery is not None:
+            # finishes the pass it is on; anything left stays spooled for next time
+            self._stopDelivery.set()
+            self._delivery.join()
+        self.dispatcher.close()
+        self.transport.close()
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    server: "ServiceServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(
+        self, status: int, body: dict | list | str, kind: str = "application/json"
+    ):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def notFound(self):
+        self._reply(404, {"error": "Not found."})
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._reply(200, self.server.service.status())
+        elif path == "/metrics":
+            self._reply(
+                200, metrics.registry.toPrometheus(), "text/plain; version=0.0.4"
+            )
+        elif path == "/metrics.json":
+            self._reply(200, metrics.registry.toJSON())
+        else:
+            self.notFound()
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/invites", "/invites/batch"):
+            self.notFound()
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            self._reply(400, {"error": f"Invalid JSON: {e}"})
+            return
+
+        # /invites takes one person, /invites/batch a list of them (or {"people": [...]})
+        single = path == "/invites"
+        if single:
+            rows = [body] if isinstance(body, dict) else None
+        else:
+            rows = body.get("people") if isinstance(body, dict) else body
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            self._reply(
+                400,
+                {
+                    "error": "Expected a person object."
+                    if single
+                    else "Expected a list of people."
+                },
+            )
+            return
+
+        try:
+            results = self.server.service.invite(rows)
+        except ServiceClosing as e:
+            self._reply(503, {"error": str(e)})
+            return
+        except Exception as e:
+            self._reply(502, {"error": str(e)})
+            return
+
+        if single:
+            result = results[0]
+            self._reply(201 if result.ok else 422, result.toDict())
+        else:
+            succeeded = sum(1 for r in results if r.ok)
+            self._reply(
+                200,
+                {
+                    "succeeded": succeeded,
+                    "failed": len(results) - succeeded,
+                    "results": [r.toDict() for r in results],
+                },
+            )
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """
+    HTTP front end for an InviteService. Request threads are joined on close, so
+    shutting down lets requests already being handled finish.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, service: InviteService, port: int, host: str = "127.0.0.1"):
+        super().__init__((host, port), _ServiceHandler)
+        self.service = service
+
+
+def serve(conf: dict, port: int, host: str = "127.0.0.1"):
+    """
+    Runs the invite service until SIGINT or SIGTERM, then stops taking requests,
+    finishes the ones in progress, and drains queued emails before returning.
+    """
+
+    service = InviteService(conf)
+    service.warm()
+    server = ServiceServer(service, port, host)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *args: stop.set())
+
+    listener = threading.Thread(target=server.serve_forever, name="service")
+    listener.start()
+    print(f"Invite service listening on http://{host}:{server.server_address[1]}")
+
+    stop.wait()
+    print("Shutting down; finishing requests and sending queued emails.")
+    server.shutdown()
+    listener.join()
+    server.server_close()
+    service.close()
+    print(f"Email delivery: {service.dispatcher.stats()}")
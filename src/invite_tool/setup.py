@@ -6,6 +6,7 @@ import time
 
 import yaml
 
+from invite_tool import config
 
 __author__ = "Noah S. Roberts"
 
@@ -20,13 +21,14 @@ confDefault = {
 
 
 def createConfFile():
-    with open("./conf/conf.yml", "w+") as f:
+    with open(config.confPath(), "w+") as f:
         yaml.safe_dump(confDefault, f)
+    config.loadConf.cache_clear()
 
 
 def getExisting() -> dict:
     existing = {}
-    with open("./conf/conf.yml", "r") as f:
+    with open(config.confPath(), "r") as f:
         try:
             existing = yaml.safe_load(f)
 
@@ -48,8 +50,9 @@ def getExisting() -> dict:
 
 
 def writeConfFile(data: dict):
-    with open("./conf/conf.yml", "w") as f:
+    with open(config.confPath(), "w") as f:
         yaml.safe_dump(data, f)
+    config.loadConf.cache_clear()
 
 
 def headless(data: dict, ignore=False):
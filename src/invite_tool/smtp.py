@@ -0,0 +1,208 @@
+import queue
+import smtplib
+import threading
+import time
+from email.message import Message
+
+from invite_tool import metrics
+
+MAILTRAP_HOST = "live.smtp.mailtrap.io"
+MAILTRAP_PORT = 587
+
+# failures that mean the connection itself is gone, not that the message was refused
+_DISCONNECTS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def retryable(e: BaseException) -> bool:
+    """
+    True for failures worth trying again: 4xx replies and dropped connections.
+    """
+
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in e.recipients.values()]
+        return bool(codes) and all(400 <= c < 500 for c in codes)
+    return isinstance(e, _DISCONNECTS)
+
+
+class _Connection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.lastUsed = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+
+class SMTPPool:
+    """
+    Small pool of logged-in SMTP connections that are reused across messages.
+
+    Each connection pays for the TCP, STARTTLS, and AUTH round trips once, then
+    sends up to maxMessages messages before it is retired. Connections that sat
+    idle are checked with NOOP before reuse, and a send that hits a dropped
+    connection is retried once on a fresh one.
+    """
+
+    def __init__(
+        self,
+        host: str = MAILTRAP_HOST,
+        port: int = MAILTRAP_PORT,
+        username: str = "",
+        password: str = "",
+        size: int = 2,
+        maxMessages: int = 100,
+        starttls: bool = True,
+        timeout: float = 30,
+        idleCheck: float = 10,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.maxMessages = maxMessages
+        self.starttls = starttls
+        self.timeout = timeout
+        # connections idle for longer than this many seconds get a NOOP before reuse
+        self.idleCheck = idleCheck
+
+        self._idle: queue.LifoQueue[_Connection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+        self.connects = 0
+        self.reuses = 0
+
+    @classmethod
+    def fromConf(cls, mailConf: dict) -> "SMTPPool":
+        """
+        Builds a pool from the mailtrap section of conf.yml.
+        """
+
+        return cls(
+            host=mailConf.get("host") or MAILTRAP_HOST,
+            port=int(mailConf.get("port") or MAILTRAP_PORT),
+            username=mailConf.get("username") or "api",
+            password=mailConf["key"],
+            size=int(mailConf.get("poolSize") or 2),
+            maxMessages=int(mailConf.get("maxMessagesPerConnection") or 100),
+            starttls=mailConf.get("starttls", True) is not False,
+        )
+
+    def _connect(self) -> _Connection:
+        with metrics.smtpLatency.time(phase="connect"):
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                with metrics.smtpLatency.time(phase="tls"):
+                    smtp.starttls()
+            if self.username != "" or self.password != "":
+                with metrics.smtpLatency.time(phase="auth"):
+                    smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+
+        self.connects += 1
+        return _Connection(smtp)
+
+    def _healthy(self, conn: _Connection) -> bool:
+        if time.monotonic() - conn.lastUsed < self.idleCheck:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self) -> _Connection:
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                if self._healthy(conn):
+                    self.reuses += 1
+                    return conn
+                conn.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: _Connection, broken: bool = False):
+        try:
+            if broken or self._closed or conn.sent >= self.maxMessages:
+                conn.close()
+            else:
+                conn.lastUsed = time.monotonic()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def send(
+        self, fromAddr: str, toAddrs: str | list[str], message: str | bytes | Message
+    ):
+        """
+        Sends one message over a pooled connection.
+        """
+
+        if self._closed:
+            raise RuntimeError("SMTP pool is closed.")
+
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                # MAIL FROM, RCPT TO, and DATA
+                with metrics.smtpLatency.time(phase="data"):
+                    if isinstance(message, Message):
+                        conn.smtp.send_message(message, fromAddr, toAddrs)
+                    else:
+                        conn.smtp.sendmail(fromAddr, toAddrs, message)
+
+            except _DISCONNECTS:
+                self._release(conn, broken=True)
+                if attempt == 1:
+                    raise
+                continue
+
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # the server refused this message; reset the transaction so the
+                # connection can still be used for the next one
+                try:
+                    conn.smtp.rset()
+                    broken = False
+                except (smtplib.SMTPException, OSError):
+                    broken = True
+                self._release(conn, broken=broken)
+                raise
+
+            except BaseException:
+                self._release(conn, broken=True)
+                raise
+
+            conn.sent += 1
+            metrics.emailsSent.inc()
+            self._release(conn)
+            return
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self) -> "SMTPPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
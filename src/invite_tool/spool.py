@@ -0,0 +1,186 @@
+import email
+import email.policy
+import itertools
+import os
+import socket
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import getaddresses, parseaddr
+
+from invite_tool.dispatch import Dispatcher
+
+# maildir-style folders: written in tmp, renamed into new, claimed into cur while
+# being delivered, then moved to sent or failed
+FOLDERS = ("tmp", "new", "cur", "sent", "failed")
+
+_counter = itertools.count()
+
+
+class Spool:
+    """
+    Directory of rendered emails waiting to be delivered.
+
+    Every move between folders is an atomic rename, so a message is always in
+    exactly one of them and a crash never leaves a half-written one in new.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        for folder in FOLDERS:
+            os.makedirs(os.path.join(path, folder), exist_ok=True)
+
+    def _file(self, folder: str, name: str) -> str:
+        return os.path.join(self.path, folder, name)
+
+    def put(self, message: bytes) -> str:
+        """
+        Spools a message and returns its name. It is in new, and safe on disk,
+        by the time this returns.
+        """
+
+        name = (
+            f"{time.time_ns()}.P{os.getpid()}Q{next(_counter)}.{socket.gethostname()}"
+        )
+        tmp = self._file("tmp", name)
+        with open(tmp, "wb") as f:
+            f.write(message)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self._file("new", name))
+        return name
+
+    def pending(self) -> list[str]:
+        """
+        Names of the messages waiting in new, oldest first.
+        """
+
+        return sorted(os.listdir(os.path.join(self.path, "new")))
+
+    def claim(self, name: str) -> EmailMessage | None:
+        """
+        Moves a message from new to cur and reads it, or returns None if another
+        worker got there first.
+        """
+
+        try:
+            os.rename(self._file("new", name), self._file("cur", name))
+        except FileNotFoundError:
+            return None
+        with open(self._file("cur", name), "rb") as f:
+            message = email.message_from_binary_file(f, policy=email.policy.default)
+        return message  # type: ignore[return-value]
+
+    def finish(self, name: str, error: BaseException | None = None):
+        """
+        Moves a claimed message to sent, or to failed with the reason written
+        beside it.
+        """
+
+        if error is None:
+            os.rename(self._file("cur", name), self._file("sent", name))
+            return
+        with open(self._file("failed", f"{name}.error"), "w") as f:
+            f.write(f"{type(error).__name__}: {error}\n")
+        os.rename(self._file("cur", name), self._file("failed", name))
+
+    def recover(self) -> int:
+        """
+        Puts messages a crashed worker had claimed back in new. Only call this
+        while no other worker is using the spool.
+        """
+
+        names = os.listdir(os.path.join(self.path, "cur"))
+        for name in names:
+            os.rename(self._file("cur", name), self._file("new", name))
+        return len(names)
+
+    def counts(self) -> dict[str, int]:
+        counts = {}
+        for folder in ("new", "cur", "sent", "failed"):
+            names = os.listdir(os.path.join(self.path, folder))
+            counts[folder] = sum(1 for n in names if not n.endswith(".error"))
+        return counts
+
+
+def spoolFromConf(mailConf: dict) -> Spool | None:
+    """
+    The spool named by mailtrap.spool in conf.yml, or None if emails are sent
+    straight away.
+    """
+
+    path = mailConf.get("spool")
+    return Spool(os.path.expanduser(str(path))) if path else None
+
+
+def envelope(message: EmailMessage) -> tuple[str, list[str]]:
+    """
+    Envelope sender and recipients of a spooled message, from its headers.
+    """
+
+    fromAddr = parseaddr(str(message["From"]))[1]
+    toAddrs = [addr for _, addr in getaddresses([str(message["To"])]) if addr]
+    return fromAddr, toAddrs
+
+
+class SpoolDeliverer:
+    """
+    Drains a spool through a Dispatcher, which sends in parallel and retries
+    with backoff. What it can't deliver after its retries goes to failed.
+    """
+
+    def __init__(self, spool: Spool, dispatcher: Dispatcher):
+        self.spool = spool
+        self.dispatcher = dispatcher
+        self.sent = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _delivered(self, name: str, done: threading.Event, future):
+        try:
+            error = future.exception()
+            self.spool.finish(name, error)
+            with self._lock:
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+        finally:
+            done.set()
+
+    def drain(self) -> int:
+        """
+        Delivers everything in new right now and waits for it. Returns how many
+        messages were taken.
+        """
+
+        deliveries: list[threading.Event] = []
+        for name in self.spool.pending():
+            message = self.spool.claim(name)
+            if message is None:
+                continue
+            done = threading.Event()
+            deliveries.append(done)
+            try:
+                fromAddr, toAddrs = envelope(message)
+            except Exception as e:
+                self.spool.finish(name, e)
+                with self._lock:
+                    self.failed += 1
+                done.set()
+                continue
+            future = self.dispatcher.submit(fromAddr, toAddrs, message)
+            future.add_done_callback(lambda f, n=name, d=done: self._delivered(n, d, f))
+
+        for done in deliveries:
+            done.wait()
+        return len(deliveries)
+
+    def run(self, stop: threading.Event, interval: float = 2):
+        """
+        Drains the spool every interval seconds until stop is set.
+        """
+
+        while not stop.is_set():
+            if self.drain() == 0:
+                stop.wait(interval)
@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+from typing import TYPE_CHECKING, Iterator
+
+from invite_tool.aioauthentik import AsyncAuthentik
+from invite_tool.authentik import INVITE_DAYS, Authentik
+
+if TYPE_CHECKING:
+    from authentik_client.models.invitation import Invitation
+
+
+class SweepResult:
+    """
+    One invitation picked by a sweep, and what happened to it.
+    """
+
+    def __init__(self, invite: "Invitation"):
+        self.name = invite.name
+        self.pk = str(invite.pk)
+        self.expires = invite.expires
+        self.deleted = False
+        self.error = ""
+
+    def __str__(self) -> str:
+        line = f"{self.name} (expires {self.expires})"
+        if self.error:
+            return f"{line} FAILED: {self.error}"
+        return f"{line} deleted" if self.deleted else line
+
+
+def cutoff(
+    olderThan: float | None = None, now: datetime.datetime | None = None
+) -> datetime.datetime:
+    """
+    Invites expiring before this are swept.
+
+    With no age, that is now, i.e. only expired invites. Invitations carry no
+    creation date, so an invite's age is worked out from its expiry, which this
+    tool always sets INVITE_DAYS after creation.
+    """
+
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if olderThan is None:
+        return now
+    return now + datetime.timedelta(days=INVITE_DAYS - olderThan)
+
+
+def _aware(when: datetime.datetime) -> datetime.datetime:
+    # naive timestamps are taken as local time
+    return when if when.tzinfo is not None else when.astimezone()
+
+
+def findStale(authObj: Authentik, before: datetime.datetime) -> Iterator["Invitation"]:
+    """
+    Yields invitations expiring before a cutoff.
+
+    The server sorts by expiry, so paging stops at the first invite past the
+    cutoff instead of reading the whole list. Invites that never expire sort last
+    and are never picked.
+    """
+
+    for invite in authObj.iterInvites(ordering="expires"):
+        if invite.expires is None or _aware(invite.expires) >= before:
+            return
+        yield invite
+
+
+def sweepInvites(
+    authObj: Authentik,
+    olderThan: float | None = None,
+    dryRun: bool = False,
+    maxConcurrency: int = 8,
+) -> list[SweepResult]:
+    """
+    Deletes expired invites, or every invite created more than olderThan days ago,
+    at most maxConcurrency at a time. A dry run only reports what would go.
+    """
+
+    results = [SweepResult(i) for i in findStale(authObj, cutoff(olderThan))]
+    if dryRun or not results:
+        return results
+
+    async def deleteAll() -> list:
+        async with AsyncAuthentik(authObj, maxConcurrency) as aioAuth:
+            return await aioAuth.deleteInvites(r.pk for r in results)
+
+    for result, outcome in zip(results, asyncio.run(deleteAll())):
+        if isinstance(outcome, BaseException):
+            result.error = str(outcome)
+        else:
+            result.deleted = True
+    return results
+
+
+def summary(results: list[SweepResult], dryRun: bool = False) -> str:
+    lines = [str(r) for r in results]
+    if dryRun:
+        lines.append(f"\n{len(results)} invites would be deleted (dry run).")
+    else:
+        deleted = sum(1 for r in results if r.deleted)
+        lines.append(
+            f"\n{deleted} of {len(results)} invites deleted, {len(results) - deleted} failed."
+        )
+    return "\n".join(lines)
@@ -0,0 +1,269 @@
+import atexit
+import collections
+import datetime
+import enum
+import gzip
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+# tape format; bumped if records change shape
+VERSION = 2
+
+# timestamps in request bodies (invite expiry dates) change from run to run
+_TIMESTAMP = re.compile(
+    r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?"
+)
+
+
+class ReplayError(LookupError):
+    """
+    Raised in replay mode for a request the tape has no response for.
+    """
+
+
+class ReplayedApiError(Exception):
+    """
+    A recorded API error, replayed when authentik_client isn't importable.
+    """
+
+    def __init__(self, status: int | None, reason: str | None, body: str | None = None):
+        super().__init__(f"({status}) {reason}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.headers = None
+
+
+def _plain(value: Any) -> Any:
+    """
+    JSON-safe form of a model, timestamp, enum, or id, for json.dumps(default=...).
+    """
+
+    # to_dict() leaves out read-only fields such as pk, which responses need
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", by_alias=True)
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return str(value)
+
+
+def requestKey(endpoint: str, args: tuple, kwargs: dict) -> str:
+    """
+    What identifies a request on the tape: the endpoint and its arguments, with
+    timestamps blanked so a rerun on another day still matches.
+    """
+
+    kwargs = {k: v for k, v in kwargs.items() if not k.startswith("_")}
+    text = json.dumps(
+        [endpoint, args, kwargs], sort_keys=True, default=_plain, separators=(",", ":")
+    )
+    return _TIMESTAMP.sub("<timestamp>", text)
+
+
+def _dumpResult(result: Any) -> Any:
+    if result is None or isinstance(result, (str, int, float, bool)):
+        return {"value": result}
+    cls = type(result)
+    data = json.loads(json.dumps(result, default=_plain))
+    return {"type": f"{cls.__module__}:{cls.__qualname__}", "data": data}
+
+
+def _loadResult(dumped: dict) -> Any:
+    if "type" not in dumped:
+        return dumped.get("value")
+    module, name = dumped["type"].split(":")
+    cls = getattr(importlib.import_module(module), name)
+    if hasattr(cls, "model_validate"):
+        return cls.model_validate(dumped["data"])
+    return cls.from_dict(dumped["data"])
+
+
+def _dumpError(e: BaseException) -> dict:
+    if hasattr(e, "status") and hasattr(e, "reason"):
+        body = getattr(e, "body", None)
+        return {
+            "api": True,
+            "status": e.status,
+            "reason": e.reason,
+            "body": body if isinstance(body, str) or body is None else str(body),
+        }
+    cls = type(e)
+    return {"type": f"{cls.__module__}:{cls.__qualname__}", "message": str(e)}
+
+
+def _loadError(dumped: dict) -> BaseException:
+    if dumped.get("api"):
+        try:
+            from authentik_client.exceptions import ApiException
+        except ImportError:
+            return ReplayedApiError(
+                dumped["status"], dumped["reason"], dumped.get("body")
+            )
+        error = ApiException(status=dumped["status"], reason=dumped["reason"])
+        error.body = dumped.get("body")
+        return error
+
+    module, name = dumped["type"].split(":")
+    try:
+        cls = getattr(importlib.import_module(module), name)
+        error = cls(dumped["message"])
+    except Exception:
+        return ConnectionError(dumped["message"])
+    return (
+        error
+        if isinstance(error, BaseException)
+        else ConnectionError(dumped["message"])
+    )
+
+
+class Recorder:
+    """
+    Writes every Authentik request made through the wrapper, with its response
+    or error and how long it took, to a gzipped JSON lines tape.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write(
+            {"version": VERSION, "recorded": datetime.datetime.now().isoformat()}
+        )
+        atexit.register(self.close)
+
+    def _write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":"), default=_plain)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def call(self, endpoint: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        key = requestKey(endpoint, args, kwargs)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._write(
+                {
+                    "endpoint": endpoint,
+                    "key": key,
+                    "seconds": time.perf_counter() - start,
+                    "error": _dumpError(e),
+                }
+            )
+            raise
+        self._write(
+            {
+                "endpoint": endpoint,
+                "key": key,
+                "seconds": time.perf_counter() - start,
+                "result": _dumpResult(result),
+            }
+        )
+        return result
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class Replayer:
+    """
+    Answers requests from a tape instead of the server.
+
+    A request gets the next unused response recorded for the same endpoint and
+    arguments; failing that, the next unused one for the endpoint, so a run that
+    asks in a slightly different order still plays through. Each response waits
+    its recorded time multiplied by speed first; 0 answers at once.
+    """
+
+    def __init__(self, path: str, speed: float = 1):
+        self.path = path
+        self.speed = max(0.0, speed)
+        self._lock = threading.Lock()
+        self._records: list[dict] = []
+        self._used: list[bool] = []
+        self._byKey: dict[str, collections.deque[int]] = collections.defaultdict(
+            collections.deque
+        )
+        self._byEndpoint: dict[str, collections.deque[int]] = collections.defaultdict(
+            collections.deque
+        )
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} Authentik tape.")
+            for line in f:
+                record = json.loads(line)
+                i = len(self._records)
+                self._records.append(record)
+                self._used.append(False)
+                self._byKey[record["key"]].append(i)
+                self._byEndpoint[record["endpoint"]].append(i)
+
+    def _next(self, queue: collections.deque[int]) -> int | None:
+        while queue:
+            i = queue.popleft()
+            if not self._used[i]:
+                self._used[i] = True
+                return i
+        return None
+
+    def call(self, endpoint: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        key = requestKey(endpoint, args, kwargs)
+        with self._lock:
+            i = self._next(self._byKey[key])
+            if i is None:
+                i = self._next(self._byEndpoint[endpoint])
+        if i is None:
+            raise ReplayError(
+                f"No recorded response left for {endpoint} in {self.path}."
+            )
+
+        record = self._records[i]
+        if self.speed:
+            time.sleep(record["seconds"] * self.speed)
+        if "error" in record:
+            raise _loadError(record["error"])
+        return _loadResult(record["result"])
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            return self._used.count(False)
+
+    def close(self):
+        pass
+
+
+def tapeFromConf(authConf: dict) -> Recorder | Replayer | None:
+    """
+    The tape named by authentik.tape in conf.yml, recording or replaying per
+    authentik.tapeMode, or None to talk to the server as usual.
+    """
+
+    path = authConf.get("tape")
+    if not path:
+        return None
+    path = os.path.expanduser(str(path))
+    mode = str(authConf.get("tapeMode") or "replay")
+    if mode == "record":
+        return Recorder(path)
+    if mode == "replay":
+        speed = authConf.get("replaySpeed")
+        return Replayer(path, 1 if speed is None else float(speed))
+    raise ValueError(f"Unknown authentik.tapeMode {mode}; use record or replay.")
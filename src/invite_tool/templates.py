@@ -0,0 +1,244 @@
+import base64
+import functools
+import html
+import os
+import secrets
+import string
+from email.policy import SMTP
+from email.utils import formataddr, formatdate
+from typing import Iterable
+
+import yaml
+
+from invite_tool import config
+
+# fragment slots in the invite template, each filled from a directory of per-group files
+SLOTS = ("links", "notes")
+
+# longest line SMTP allows, not counting CRLF
+_MAX_LINE = 998
+
+
+class CompiledTemplate:
+    """
+    A string.Template-style template (${name} placeholders) parsed once into
+    alternating literal text and field names, so rendering is a single join.
+    """
+
+    def __init__(self, text: str):
+        self.literals: list[str] = []
+        self.fields: list[str] = []
+
+        pending: list[str] = []
+        last = 0
+        for m in string.Template.pattern.finditer(text):
+            if m.group("invalid") is not None:
+                raise ValueError(
+                    f"Invalid placeholder in template at position {m.start()}."
+                )
+
+            pending.append(text[last : m.start()])
+            last = m.end()
+            if m.group("escaped") is not None:
+                # "$$" is a literal "$"
+                pending.append("$")
+                continue
+
+            self.literals.append("".join(pending))
+            self.fields.append(m.group("named") or m.group("braced"))
+            pending = []
+
+        pending.append(text[last:])
+        self.literals.append("".join(pending))
+
+    def render(self, values: dict[str, str]) -> str:
+        out = [self.literals[0]]
+        for name, literal in zip(self.fields, self.literals[1:]):
+            out.append(values[name])
+            out.append(literal)
+        return "".join(out)
+
+
+def _header(name: str, value: str) -> bytes:
+    # ASCII values that fit on a line need no encoding or folding
+    if value.isascii() and "\n" not in value and len(name) + len(value) < 76:
+        return f"{name}: {value}\r\n".encode()
+    return SMTP.fold(name, value).encode()
+
+
+def _part(subtype: str, text: str) -> bytes:
+    """
+    A text part with its headers. ASCII text with short enough lines goes as is,
+    like EmailMessage would send it; anything else is base64 encoded.
+    """
+
+    lines = text.splitlines()
+    if text.isascii() and max(map(len, lines), default=0) <= _MAX_LINE:
+        encoding = b"7bit"
+        body = "\r\n".join(lines).encode()
+        if text.endswith(("\n", "\r")):
+            body += b"\r\n"
+    else:
+        encoding = b"base64"
+        body = base64.encodebytes(text.encode()).replace(b"\n", b"\r\n")
+    return (
+        b"Content-Type: text/"
+        + subtype.encode()
+        + b'; charset="utf-8"\r\nContent-Transfer-Encoding: '
+        + encoding
+        + b"\r\n\r\n"
+        + body
+    )
+
+
+def _read(path: str) -> str | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read()
+
+
+class InviteTemplates:
+    """
+    The invite email templates from conf/templates, loaded and parsed once.
+
+    invite.txt (and optionally invite.html) hold the message. Group-specific
+    fragments live in one directory per slot, e.g. links/plexuser.txt is dropped
+    into ${links} for members of plexuser. Adding a file there is all it takes to
+    support another group. The fragments for each combination of groups are
+    joined once and reused.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        with open(os.path.join(directory, "headers.yml"), "r") as f:
+            self.headers: dict = yaml.safe_load(f) or {}
+
+        text = _read(os.path.join(directory, "invite.txt"))
+        if text is None:
+            raise FileNotFoundError(f"No invite.txt in {directory}.")
+        self.text = CompiledTemplate(text)
+
+        htmlText = _read(os.path.join(directory, "invite.html"))
+        self.html = CompiledTemplate(htmlText) if htmlText is not None else None
+
+        # slot -> group -> (plain, html)
+        self.fragments: dict[str, dict[str, tuple[str, str]]] = {}
+        for slot in SLOTS:
+            self.fragments[slot] = {}
+            slotDir = os.path.join(directory, slot)
+            if not os.path.isdir(slotDir):
+                continue
+            for name in sorted(os.listdir(slotDir)):
+                group, ext = os.path.splitext(name)
+                if ext != ".txt":
+                    continue
+                plain = _read(os.path.join(slotDir, name)) or ""
+                rich = _read(os.path.join(slotDir, f"{group}.html"))
+                # fall back to the escaped plain fragment if there is no HTML one
+                if rich is None:
+                    rich = f"<pre>{html.escape(plain)}</pre>\n" if plain else ""
+                self.fragments[slot][group] = (plain, rich)
+
+        self._known = frozenset(g for slot in self.fragments.values() for g in slot)
+        self._cache: dict[tuple[str, ...], dict[str, str]] = {}
+
+        # the headers and MIME framing are the same for every invite, so they are
+        # encoded once and each message only splices in what differs
+        self._fixed = _header("Subject", str(self.headers.get("subject", "")))
+        if self.headers.get("category"):
+            self._fixed += _header("Category", str(self.headers["category"]))
+        self._fixed += b"MIME-Version: 1.0\r\n"
+        boundary = f"=_{secrets.token_hex(16)}".encode()
+        self._open = b"--" + boundary + b"\r\n"
+        self._between = b"\r\n--" + boundary + b"\r\n"
+        self._close = b"\r\n--" + boundary + b"--\r\n"
+        self._multipart = (
+            b'Content-Type: multipart/alternative; boundary="' + boundary + b'"\r\n\r\n'
+        )
+        self._from: dict[str, bytes] = {}
+
+    def groupFragments(self, groups: Iterable[str]) -> dict[str, str]:
+        """
+        Plain and HTML text for every slot, for the given groups. The result is
+        keyed "<slot>" and "<slot>_html".
+        """
+
+        key = tuple(sorted(self._known.intersection(groups)))
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        joined = {}
+        for slot, byGroup in self.fragments.items():
+            parts = [byGroup[g] for g in key if g in byGroup]
+            joined[slot] = "".join(p for p, _ in parts)
+            joined[f"{slot}_html"] = "".join(h for _, h in parts)
+
+        self._cache[key] = joined
+        return joined
+
+    def renderText(self, values: dict[str, str], groups: Iterable[str]) -> str:
+        fragments = self.groupFragments(groups)
+        return self.text.render({**values, **{s: fragments[s] for s in SLOTS}})
+
+    def renderHtml(self, values: dict[str, str], groups: Iterable[str]) -> str | None:
+        if self.html is None:
+            return None
+        fragments = self.groupFragments(groups)
+        escaped = {k: html.escape(v) for k, v in values.items()}
+        return self.html.render(
+            {**escaped, **{s: fragments[f"{s}_html"] for s in SLOTS}}
+        )
+
+    def message(
+        self,
+        fromAddr: str,
+        toName: str,
+        toAddr: str,
+        values: dict[str, str],
+        groups: Iterable[str],
+    ) -> bytes:
+        """
+        Builds the full invite, ready to send or spool, as multipart/alternative if
+        there is an HTML template.
+        """
+
+        groups = list(groups)
+        sender = self._from.get(fromAddr)
+        if sender is None:
+            sender = _header(
+                "From", formataddr((self.headers.get("fromName", ""), fromAddr))
+            )
+            self._from[fromAddr] = sender
+
+        out = [
+            self._fixed,
+            sender,
+            _header("To", formataddr((toName, toAddr))),
+            _header("Date", formatdate(localtime=True)),
+        ]
+        text = _part("plain", self.renderText(values, groups))
+        rich = self.renderHtml(values, groups)
+        if rich is None:
+            out.append(text)
+        else:
+            out += [
+                self._multipart,
+                self._open,
+                text,
+                self._between,
+                _part("html", rich),
+                self._close,
+            ]
+        return b"".join(out)
+
+
+@functools.cache
+def inviteTemplates() -> InviteTemplates:
+    """
+    The templates in conf/templates, loaded the first time an invite is rendered.
+    """
+
+    return InviteTemplates(config.sharedPath("templates"))
@@ -0,0 +1,162 @@
+import json
+import socket
+import urllib.error
+import urllib.request
+from typing import Any
+
+from invite_tool import metrics, resilience
+from invite_tool.user import HomelabUser
+
+# mutations sent in one GraphQL request
+BATCH_SIZE = 25
+
+
+class TwingateError(Exception):
+    pass
+
+
+def _retryable(e: BaseException) -> bool:
+    """
+    userCreate is not idempotent, so only failures where Twingate cannot have
+    acted on the request are retried: rate limiting, and connections that never
+    got as far as sending it. A 5xx or a timeout may come after the users were
+    made.
+    """
+
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code == 429
+    if isinstance(e, urllib.error.URLError):
+        return isinstance(e.reason, (ConnectionRefusedError, socket.gaierror))
+    return isinstance(e, ConnectionRefusedError)
+
+
+def _retryAfter(e: BaseException) -> float | None:
+    if isinstance(e, urllib.error.HTTPError):
+        return resilience.parseRetryAfter(e.headers.get("Retry-After"))
+    return None
+
+
+def _mutation(count: int) -> str:
+    """
+    One userCreate per user, aliased u0, u1, ... so they share a request but
+    succeed or fail on their own.
+    """
+
+    params = []
+    fields = []
+    for i in range(count):
+        params.append(
+            f"$email{i}: String!, $firstName{i}: String, $lastName{i}: String"
+        )
+        fields.append(
+            f"u{i}: userCreate(email: $email{i}, firstName: $firstName{i}, lastName: $lastName{i}, "
+            f"role: MEMBER, shouldSendInvite: true) {{ ok error entity {{ id }} }}"
+        )
+    return f"mutation CreateUsers({', '.join(params)}) {{ {' '.join(fields)} }}"
+
+
+class Twingate:
+    """
+    Twingate Admin API client for adding invited users to the network.
+
+    Users are created with userCreate, which also sends Twingate's own invite
+    email. Mutations for a whole roster go out batchSize per request.
+    """
+
+    def __init__(
+        self,
+        network: str,
+        key: str,
+        groups: list[str] | None = None,
+        batchSize: int = BATCH_SIZE,
+        timeout: float = 30,
+        url: str = "",
+    ):
+        self.url = url or f"https://{network}.twingate.com/api/graphql/"
+        self.key = key
+        # Authentik groups whose members need Twingate
+        self.groups = set(groups if groups is not None else ["admin"])
+        self.batchSize = max(1, batchSize)
+        self.timeout = timeout
+        self.retryPolicy = resilience.RetryPolicy(
+            retryable=_retryable, retryAfter=_retryAfter
+        )
+        self.breaker = resilience.breaker("twingate")
+
+    @classmethod
+    def fromConf(cls, tgConf: dict | None) -> "Twingate | None":
+        """
+        The client for the twingate section of conf.yml, or None if Twingate is
+        not in use.
+        """
+
+        if not tgConf or not tgConf.get("use"):
+            return None
+        return cls(
+            str(tgConf.get("network") or ""),
+            str(tgConf.get("key") or ""),
+            groups=tgConf.get("groups"),
+            batchSize=int(tgConf.get("batchSize") or BATCH_SIZE),
+            url=str(tgConf.get("url") or ""),
+        )
+
+    def wants(self, user: HomelabUser) -> bool:
+        return not self.groups.isdisjoint(user.groups)
+
+    def _post(self, query: str, variables: dict[str, Any]) -> dict:
+        body = json.dumps({"query": query, "variables": variables}).encode()
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json", "X-API-KEY": self.key},
+            method="POST",
+        )
+
+        def send() -> dict:
+            with metrics.twingateLatency.time():
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.load(response)
+
+        reply = resilience.call(send, policy=self.retryPolicy, breaker=self.breaker)
+        if reply.get("errors"):
+            raise TwingateError(
+                "; ".join(str(e.get("message", e)) for e in reply["errors"])
+            )
+        return reply.get("data") or {}
+
+    def _createBatch(self, users: list[HomelabUser]) -> list[str | TwingateError]:
+        variables: dict[str, Any] = {}
+        for i, user in enumerate(users):
+            variables[f"email{i}"] = user.email
+            variables[f"firstName{i}"] = user.first
+            variables[f"lastName{i}"] = user.last
+
+        try:
+            data = self._post(_mutation(len(users)), variables)
+        except Exception as e:
+            error = e if isinstance(e, TwingateError) else TwingateError(str(e))
+            return [error] * len(users)
+
+        outcomes: list[str | TwingateError] = []
+        for i in range(len(users)):
+            payload = data.get(f"u{i}") or {}
+            if payload.get("ok"):
+                metrics.twingateUsersCreated.inc()
+                outcomes.append(str((payload.get("entity") or {}).get("id") or ""))
+            else:
+                outcomes.append(
+                    TwingateError(payload.get("error") or "userCreate failed.")
+                )
+        return outcomes
+
+    def createUsers(self, users: list[HomelabUser]) -> list[str | TwingateError]:
+        """
+        Creates every user, batchSize per request. Each comes back as its
+        Twingate id or as the TwingateError that stopped it; one failing does not
+        stop the rest.
+        """
+
+        outcomes: list[str | TwingateError] = []
+        for start in range(0, len(users), self.batchSize):
+            outcomes.extend(self._createBatch(users[start : start + self.batchSize]))
+        return outcomes
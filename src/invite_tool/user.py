@@ -1,15 +1,22 @@
-import yaml
+import functools
 
+from invite_tool import config
 from invite_tool.mail import Email
 from invite_tool.phone import Phone
+from invite_tool.username import UsernameFormat
 
 
 class ExistsError(Exception):
     pass
 
 
-with open("./conf/conf.yml", "r") as f:
-    usernameFormat: dict[str, str | None] = yaml.safe_load(f)["formats"]["username"]
+@functools.cache
+def usernameFormat() -> UsernameFormat:
+    """
+    The compiled formats.username section of conf.yml, built on first use.
+    """
+
+    return UsernameFormat(config.loadConf()["formats"]["username"])
 
 
 class HomelabUser:
@@ -19,6 +26,8 @@ class HomelabUser:
 
     Holds an Authentik user's first and last name, username, email, and optional attributes for use in a user invitation.
 
+    Building one does no I/O; check it against the directory with validateUser.
+
     Required attributes (args)
     --------------------------
             firstName (str): user's first name
@@ -33,9 +42,19 @@ class HomelabUser:
             middleInitial (str): user's middle inital; not used if middleName is set
     """
 
+    __slots__ = (
+        "first",
+        "last",
+        "middleName",
+        "middleInitial",
+        "username",
+        "groups",
+        "email",
+        "phone",
+    )
+
     def __init__(
         self,
-        authObj,
         firstName: str,
         lastName: str,
         email: str,
@@ -51,22 +70,12 @@ class HomelabUser:
         self.middleName = middleName.title()
         self.middleInitial = middleInitial.upper()
 
-        knownUsers = authObj.fetchUserList()
-
         if username == "":
             self.username = self._makeUsername()
         else:
             self.username = username
 
-        if self.username in knownUsers:
-            raise ExistsError(f"User {self.username} already exists.")
-
-        knownGroups = authObj.fetchGroupList()
-        for group in groups:
-            if group not in knownGroups:
-                print(f"Unknown group {group}. Removing from list.")
-                groups.remove(group)
-        self.groups = groups
+        self.groups = list(groups)
 
         self.email = Email(email).addr
 
@@ -79,41 +88,9 @@ class HomelabUser:
         return self.username
 
     def _makeUsername(self) -> str:
-        # separator
-        if usernameFormat["separator"] != "":
-            sep1 = usernameFormat["separator"]
-            sep2 = usernameFormat["separator"]
-        else:
-            sep1 = ""
-            sep2 = ""
-
-        # first name
-        if usernameFormat["first"] == "full":
-            first = self.first.lower()
-        elif usernameFormat["first"] == "initial":
-            first = self.first.lower()[0]
-        else:
-            first = ""
-            sep1 = ""
-
-        # middle name
-        if usernameFormat["middle"] == "full":
-            middle = self.middleName.lower()
-        elif usernameFormat["middle"] == "initial":
-            middle = self.middleInitial.lower()
-        else:
-            middle = ""
-            sep2 = ""
-
-        # first name
-        if usernameFormat["last"] == "full":
-            last = self.last.lower()
-        elif usernameFormat["last"] == "initial":
-            last = self.last.lower()[0]
-        else:
-            last = ""
-
-        return f"{first}{sep1}{middle}{sep2}{last}"
+        return usernameFormat()(
+            self.first, self.last, self.middleName, self.middleInitial
+        )
 
     def fullName(self) -> str:
         if self.middleInitial != "":
@@ -143,3 +120,26 @@ Phone: {self.phone}
             "groups_to_add": self.groups,
             "invite_expires": "",
         }
+
+
+def validateUser(user: HomelabUser, directory) -> HomelabUser:
+    """
+    Checks a user against the directory, raising ExistsError if the username
+    belongs to an account and dropping groups that don't exist.
+
+    directory is anything with userExists and groupExists: a prebuilt
+    DirectoryIndex, or an Authentik object, which asks the server about just these
+    names.
+    """
+
+    if directory.userExists(user.username):
+        raise ExistsError(f"User {user.username} already exists.")
+
+    groups = []
+    for group in user.groups:
+        if directory.groupExists(group):
+            groups.append(group)
+        else:
+            print(f"Unknown group {group}. Removing from list.")
+    user.groups = groups
+    return user
@@ -0,0 +1,158 @@
+from typing import Callable, Iterable, Protocol
+
+PARTS = ("first", "middle", "last")
+# what to do when a generated username is already taken
+STRATEGIES = ("number", "middle", "error")
+
+
+class _Named(Protocol):
+    first: str
+    last: str
+    middleName: str
+    middleInitial: str
+    username: str
+
+
+def _full(value: str) -> str:
+    return value.lower()
+
+
+def _initial(value: str) -> str:
+    return value[:1].lower()
+
+
+class UsernameFormat:
+    """
+    The formats.username section of conf.yml, compiled once into a callable.
+
+    Each part may be given either as a bare form ("full", "initial", or empty) or
+    as a mapping with "form" and "order" keys. Parts without a form are left out,
+    and the separator only goes between parts that are present.
+    """
+
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.separator: str = spec.get("separator") or ""
+        self.collision: str = spec.get("collision") or "number"
+        if self.collision not in STRATEGIES:
+            raise ValueError(
+                f"Unknown username collision strategy {self.collision}. "
+                f"Use one of {', '.join(STRATEGIES)}."
+            )
+
+        ordered = []
+        for position, name in enumerate(PARTS):
+            part = spec.get(name)
+            if isinstance(part, dict):
+                form, order = part.get("form"), part.get("order")
+            else:
+                form, order = part, None
+
+            if form not in ("full", "initial"):
+                continue
+            ordered.append(
+                (position if order in (None, "") else int(order), position, name, form)
+            )
+
+        self.parts: list[tuple[str, str]] = [
+            (name, form) for _, _, name, form in sorted(ordered)
+        ]
+        self._steps: list[tuple[int, Callable[[str], str]]] = [
+            (PARTS.index(name), _full if form == "full" else _initial)
+            for name, form in self.parts
+        ]
+
+    def __call__(
+        self, first: str, last: str, middleName: str = "", middleInitial: str = ""
+    ) -> str:
+        # middle "initial" falls back to the first letter of the middle name
+        values = (first, middleName if middleName else middleInitial, last)
+        pieces = [step(values[i]) for i, step in self._steps]
+        return self.separator.join(p for p in pieces if p != "")
+
+    def withMiddleInitial(self) -> "UsernameFormat | None":
+        """
+        The same format with the middle initial added, for telling apart people whose
+        usernames would otherwise collide. None if the middle name is already used.
+        """
+
+        if any(name == "middle" for name, _ in self.parts):
+            return None
+
+        spec = {
+            name: {"form": form, "order": i * 2}
+            for i, (name, form) in enumerate(self.parts)
+        }
+        # slot the middle initial right after the first name, or first if there is none
+        firstAt = next(
+            (i for i, (name, _) in enumerate(self.parts) if name == "first"), -1
+        )
+        spec["middle"] = {"form": "initial", "order": firstAt * 2 + 1}
+        spec["separator"] = self.separator
+        spec["collision"] = self.collision
+        return UsernameFormat(spec)
+
+    def forPerson(self, person: _Named) -> str:
+        return self(person.first, person.last, person.middleName, person.middleInitial)
+
+
+def resolveUsernames(
+    people: Iterable[_Named],
+    fmt: UsernameFormat,
+    isTaken: Callable[[str], bool],
+    strategy: str | None = None,
+) -> list[str]:
+    """
+    Assigns a username to everyone in a roster, in order, so reruns give the same
+    answer.
+
+    Usernames given in the roster are kept as-is and reserved first. Generated
+    ones that are taken, either in the directory or earlier in the roster, are
+    resolved by strategy: "number" appends 2, 3, ...; "middle" tries adding the
+    middle initial before numbering; "error" leaves the clash for validation to
+    report. Suffix counters are remembered per base name, so this stays linear.
+
+    Someone whose name makes an empty username gets "" and claims nothing.
+    """
+
+    people = list(people)
+    strategy = strategy or fmt.collision
+    alternate = fmt.withMiddleInitial() if strategy == "middle" else None
+
+    claimed: set[str] = set()
+    usernames: list[str | None] = [None] * len(people)
+    for i, person in enumerate(people):
+        if person.username:
+            usernames[i] = person.username
+            claimed.add(person.username)
+
+    def free(name: str) -> bool:
+        return name not in claimed and not isTaken(name)
+
+    nextSuffix: dict[str, int] = {}
+    for i, person in enumerate(people):
+        if usernames[i] is not None:
+            continue
+
+        base = fmt.forPerson(person)
+        if not base:
+            continue
+        name = base
+
+        if strategy != "error" and not free(name):
+            if alternate is not None:
+                candidate = alternate.forPerson(person)
+                if candidate != base and free(candidate):
+                    name = candidate
+
+            if not free(name):
+                n = nextSuffix.get(base, 2)
+                while not free(f"{base}{n}"):
+                    n += 1
+                name = f"{base}{n}"
+                nextSuffix[base] = n + 1
+
+        claimed.add(name)
+        usernames[i] = name
+
+    return [u or "" for u in usernames]